@@ -0,0 +1,16 @@
+# 테스트 공통 설정: voiceroom/ingribo.py를 모듈로 import할 수 있게 한다.
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "voiceroom"))
+
+# 영구 캐시(SQLite)는 테스트에서 만들지 않는다
+os.environ.setdefault("TRACK_DB_PATH", "")
+
+# dico_token.py는 컨테이너 시작 때 entrypoint가 DISCORD_TOKEN으로 만든다. 테스트는 로그인하지 않으므로 빈 토큰.
+try:
+    import dico_token  # noqa: F401
+except ImportError:
+    sys.modules["dico_token"] = types.SimpleNamespace(Token="")
@@ -0,0 +1,78 @@
+# 재생목록 커서: 첫 페이지 추출 중에 가져오기 작업이 취소돼도 커서가 남지 않아야 한다.
+import asyncio
+import threading
+
+import pytest
+
+import ingribo
+
+
+class _SlowPlaylistYDL:
+    """첫 extract_info가 release될 때까지 막히는 YoutubeDL 대역."""
+
+    def __init__(self, started: threading.Event, release: threading.Event):
+        self.params = {}
+        self._started = started
+        self._release = release
+
+    def extract_info(self, url, download=False, process=True, ie_key=None):
+        self._started.set()
+        self._release.wait(5)
+        entries = ({"id": f"{i:011d}", "title": f"곡 {i}", "url": f"https://youtu.be/{i:011d}"} for i in range(30))
+        return {"_type": "playlist", "title": "재생목록", "entries": entries}
+
+
+@pytest.fixture
+def slow_playlist(monkeypatch):
+    started, release, closed = threading.Event(), threading.Event(), []
+
+    class _Entry:
+        def __init__(self, client, default_search, flat):
+            self.ydl = _SlowPlaylistYDL(started, release)
+
+        def close(self):
+            closed.append(self)
+
+    monkeypatch.setattr(ingribo, "_PooledYDL", _Entry)
+    monkeypatch.setattr(ingribo, "EXTRACT_BACKEND", "thread")
+    monkeypatch.setattr(ingribo, "rate_limiter", ingribo.ExtractionRateLimiter(0, 1, 0, 1))
+    yield started, release, closed
+    release.set()
+
+
+def test_cancel_during_first_page_closes_cursor(slow_playlist):
+    started, release, closed = slow_playlist
+
+    async def consume():
+        async for _ in ingribo.iter_playlist("https://www.youtube.com/playlist?list=PLx", guild_id=1):
+            pass
+
+    async def main():
+        task = asyncio.ensure_future(consume())
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # 취소된 뒤에 첫 페이지 추출이 끝나도 커서는 등록되지 않고 닫힌다
+        release.set()
+        for _ in range(50):
+            if closed:
+                break
+            await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert ingribo._playlist_cursors == {}
+    assert len(closed) == 1
+
+
+def test_finished_import_closes_cursor(slow_playlist):
+    started, release, closed = slow_playlist
+    release.set()
+
+    async def consume():
+        return [page async for page in ingribo.iter_playlist("https://www.youtube.com/playlist?list=PLx", limit=25)]
+
+    pages = asyncio.run(consume())
+    assert sum(len(p["entries"]) for p in pages) == 25
+    assert ingribo._playlist_cursors == {}
+    assert len(closed) == 1
@@ -0,0 +1,114 @@
+# PotProviderSupervisor를 로컬 http.server 공급자 대역(stand-in)으로 검증한다.
+import asyncio
+import http.server
+import threading
+
+import pytest
+
+import ingribo
+
+
+class _Provider(http.server.BaseHTTPRequestHandler):
+    """bgutil 공급자 대역. /ping을 server.healthy에 따라 200/503으로 답하고 keep-alive를 유지한다."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        status = 200 if self.server.healthy else 503
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def provider():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Provider)
+    server.healthy = True
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def supervisor(provider, monkeypatch):
+    url = f"http://127.0.0.1:{provider.server_address[1]}"
+    sup = ingribo.PotProviderSupervisor(url, threshold=3, recover=2, timeout=2)
+    monkeypatch.setattr(ingribo, "pot_supervisor", sup)
+    monkeypatch.setattr(ingribo, "_pot_ok_override", None)
+    monkeypatch.setattr(ingribo, "extraction_config", ingribo.ExtractionConfig(url, None, False))
+    yield sup
+    if sup._conn is not None:
+        sup._conn.close()
+
+
+def _probe(sup, times=1):
+    for _ in range(times):
+        asyncio.run(sup.probe())
+
+
+def test_breaker_opens_recovers_and_invalidates_pool(provider, supervisor):
+    gen = ingribo.ydl_pool.generation
+    _probe(supervisor)
+    assert supervisor.state == ingribo.POT_CLOSED
+
+    provider.healthy = False
+    _probe(supervisor, 2)
+    assert supervisor.state == ingribo.POT_CLOSED  # threshold 전까지는 유지
+    _probe(supervisor)
+    assert supervisor.state == ingribo.POT_OPEN
+    assert not ingribo.pot_available()
+    assert ingribo.ydl_pool.generation == gen + 1
+
+    provider.healthy = True
+    _probe(supervisor)
+    assert supervisor.state == ingribo.POT_HALF_OPEN
+    assert not ingribo.pot_available()
+    assert ingribo.ydl_pool.generation == gen + 1  # 아직 저하 모드 → 풀 그대로
+
+    _probe(supervisor)
+    assert supervisor.state == ingribo.POT_CLOSED
+    assert ingribo.pot_available()
+    assert ingribo.ydl_pool.generation == gen + 2
+
+
+def test_half_open_failure_reopens(provider, supervisor):
+    provider.healthy = False
+    _probe(supervisor, 3)
+    provider.healthy = True
+    _probe(supervisor)
+    assert supervisor.state == ingribo.POT_HALF_OPEN
+    provider.healthy = False
+    _probe(supervisor)
+    assert supervisor.state == ingribo.POT_OPEN
+
+
+def test_degraded_opts_skip_pot(provider, supervisor):
+    opts = ingribo._ydl_opts_base()
+    assert opts["extractor_args"] == {"youtubepot-bgutilhttp": {"base_url": [supervisor.base_url]}}
+
+    provider.healthy = False
+    _probe(supervisor, 3)
+    opts = ingribo._ydl_opts_base()
+    assert opts["extractor_args"] == {"youtube": {"fetch_pot": ["never"]}}
+
+
+def test_connection_reused_and_reconnected_once(provider, supervisor):
+    for _ in range(3):
+        supervisor.ping()
+    assert provider.connections == 1
+
+    # 서버 쪽에서 유휴 연결이 끊긴 경우: 한 번 새로 연결해 성공
+    supervisor._conn.sock.close()
+    supervisor.ping()
+    assert provider.connections == 2
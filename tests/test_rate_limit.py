@@ -0,0 +1,48 @@
+# 추출 속도 제한: player_client 폴백으로 더 나간 추출은 전역 버킷에서만 차감된다.
+import asyncio
+
+import pytest
+
+import ingribo
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    rl = ingribo.ExtractionRateLimiter(global_per_min=30, global_burst=10, guild_per_min=12, guild_burst=4)
+    monkeypatch.setattr(ingribo, "rate_limiter", rl)
+    monkeypatch.setattr(ingribo, "YTDLP_HEDGE", False)
+    monkeypatch.setattr(ingribo.client_scores, "order", lambda: [list(c) for c in ingribo.PLAYER_CLIENTS])
+    return rl
+
+
+def test_fallback_resolution_costs_one_guild_token(limiter, monkeypatch):
+    last = ingribo.PLAYER_CLIENTS[-1]
+
+    def attempt(client, extract_fn, args, default_search):
+        if client != last:
+            raise RuntimeError("Sign in to confirm you're not a bot")
+        return {"id": "abcdefghijk"}
+
+    monkeypatch.setattr(ingribo, "_attempt_client", attempt)
+
+    def resolve():
+        return ingribo._extract_with_clients(None)
+
+    info = asyncio.run(ingribo.limited_run(1, resolve))
+    assert info == {"id": "abcdefghijk"}
+    fallbacks = len(ingribo.PLAYER_CLIENTS) - 1
+    assert limiter.extra_charged == fallbacks
+    assert limiter._buckets[1].tokens == pytest.approx(4 - 1, abs=0.01)
+    assert limiter._global.tokens == pytest.approx(10 - 1 - fallbacks, abs=0.01)
+
+
+def test_failed_fallback_chain_charges_global_only(limiter, monkeypatch):
+    def attempt(client, extract_fn, args, default_search):
+        raise RuntimeError("unavailable")
+
+    monkeypatch.setattr(ingribo, "_attempt_client", attempt)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(ingribo.limited_run(2, ingribo._extract_with_clients, None))
+    assert limiter._buckets[2].tokens == pytest.approx(3, abs=0.01)
+    assert limiter._global.tokens == pytest.approx(10 - len(ingribo.PLAYER_CLIENTS), abs=0.01)
@@ -0,0 +1,49 @@
+# 시작 예열(warm_up_extraction): 기본은 네트워크 없이 YoutubeDL 풀만 채우고, 프로브 실패는 결과로 드러나야 한다.
+import asyncio
+import socket
+
+import pytest
+
+import ingribo
+
+
+@pytest.fixture
+def warmup(monkeypatch):
+    monkeypatch.setattr(ingribo, "YTDLP_WARMUP_PROBE", "")
+    monkeypatch.setattr(ingribo, "YTDLP_WARMUP_SEARCH", "")
+    monkeypatch.setattr(ingribo, "pot_supervisor", None)
+    monkeypatch.setattr(ingribo, "po_token_cache", None)
+    monkeypatch.setattr(ingribo, "warmup_timings", {})
+    monkeypatch.setattr(ingribo, "warmup_failures", [])
+    ingribo.ydl_pool.invalidate()
+    yield
+    ingribo.ydl_pool.invalidate()
+
+
+def test_default_warmup_primes_pool_without_network(warmup, monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError("기본 예열은 네트워크를 쓰지 않아야 함")
+
+    monkeypatch.setattr(socket.socket, "connect", no_network)
+    monkeypatch.setattr(ingribo, "limited_run", no_network)
+
+    assert asyncio.run(ingribo.warm_up_extraction())
+    idle = ingribo.ydl_pool._idle
+    for client in ingribo.PLAYER_CLIENTS:
+        assert idle.get((tuple(client), None, False)), client
+    first = tuple(ingribo.PLAYER_CLIENTS[0])
+    assert idle.get((first, "ytsearch5", True))
+    assert idle.get((first, None, True))
+    assert ingribo.warmup_failures == []
+
+
+def test_failed_probe_is_reported(warmup, monkeypatch):
+    async def failing_run(guild_id, fn, *args, on_wait=None):
+        raise RuntimeError("Sign in to confirm you're not a bot")
+
+    monkeypatch.setattr(ingribo, "YTDLP_WARMUP_PROBE", "https://www.youtube.com/watch?v=jNQXAC9IVRw")
+    monkeypatch.setattr(ingribo, "limited_run", failing_run)
+
+    assert not asyncio.run(ingribo.warm_up_extraction())
+    assert ingribo.warmup_failures == ["probe"]
+    assert ingribo.warmup_timings["probe"].startswith("실패")
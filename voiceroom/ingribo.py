@@ -1,36 +1,128 @@
 # ingribo.py
+import time
+_MODULE_T0 = time.monotonic()
+
+def _process_start_monotonic() -> float:
+    """프로세스 시작 시각(monotonic 기준). 리눅스는 /proc에서 읽어 인터프리터 기동까지 포함하고, 아니면 모듈 시작."""
+    try:
+        import os
+        with open("/proc/self/stat") as f:
+            # comm(괄호 안)에 공백이 있을 수 있어 마지막 ')' 뒤부터 센다. starttime은 22번째 필드.
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.monotonic() - max(age, 0.0)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return _MODULE_T0
+
+_BOOT_T0 = _process_start_monotonic()  # 부팅 타임라인 기준점 (프로세스 시작)
+
 import os
 import re
-import time
+import sys
 import random
 import shutil
-import tempfile
 import asyncio
-from typing import List, Optional, Dict
+import atexit
+import threading
+import copy
+import json
+import unicodedata
+import contextlib
+import concurrent.futures  # asyncio가 어차피 불러오므로 지연해도 이득 없음
+import itertools
+import ctypes.util
+import signal
+from collections import deque, OrderedDict
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from typing import List, Optional, Dict, Tuple
 
 import discord
 from discord.ext import commands
 from dico_token import Token
-import yt_dlp
+# yt_dlp는 import가 무거워(extractor 로드) 봇 시작 경로에서 빼고 get_yt_dlp()로 처음 쓸 때 불러온다.
+# sqlite3(영구 캐시), http.client(POT 공급자), multiprocessing(process 백엔드)도 처음 쓰는 곳에서 import.
+
+# =========================
+# 부팅 타임라인 (모듈 시작 → 게이트웨이 READY)
+# =========================
+BOOT_TIMELINE: List[Tuple[str, float]] = []
+
+def boot_mark(phase: str):
+    """부팅 단계 완료 시점을 기록(단계마다 처음 한 번만)."""
+    if all(name != phase for name, _ in BOOT_TIMELINE):
+        BOOT_TIMELINE.append((phase, time.monotonic() - _BOOT_T0))
+
+def boot_timeline_text() -> str:
+    parts = []
+    prev = 0.0
+    for name, at in BOOT_TIMELINE:
+        parts.append(f"{name} +{at - prev:.2f}s")
+        prev = at
+    return ", ".join(parts) + f" (합계 {prev:.2f}s)"
+
+if _MODULE_T0 > _BOOT_T0:
+    BOOT_TIMELINE.append(("interpreter", _MODULE_T0 - _BOOT_T0))
+boot_mark("imports")
+
+# EXTRACT_BACKEND=process의 spawn 워커는 이 파일을 __mp_main__으로 다시 import한다(추출 함수를 찾으려고).
+# 워커에는 봇 쪽 준비(opus, SQLite 캐시, 중첩 프로세스 풀, 설정 출력)가 필요 없으므로 건너뛴다.
+# (import 중에는 multiprocessing.parent_process()가 아직 None이라 모듈 이름으로 판단)
+IN_EXTRACT_WORKER = __name__ == "__mp_main__"
+
+# =========================
+# yt_dlp 지연 import
+# =========================
+_yt_dlp = None
+
+def get_yt_dlp():
+    """yt_dlp 모듈을 처음 필요할 때(첫 추출 또는 on_ready 예열) import해 돌려준다."""
+    global _yt_dlp
+    if _yt_dlp is None:
+        t0 = time.monotonic()
+        import yt_dlp
+        _yt_dlp = yt_dlp
+        print(f"[YTDLP] imported yt_dlp in {time.monotonic() - t0:.2f}s")
+    return _yt_dlp
 
 # =========================
-# (선택) Opus 강제 로드 - mac 테스트용, 리눅스에선 무시돼도 OK
+# Opus 로드 (플랫폼별 탐색, 이미 로드돼 있으면 생략)
 # =========================
-OPUS_LIB_PATH = "/opt/homebrew/lib/libopus.dylib"
-try:
-    discord.opus.load_opus(OPUS_LIB_PATH)
-    print(f"[OPUS] Loaded opus from {OPUS_LIB_PATH}")
-except OSError as e:
-    print(f"[OPUS] Failed to load opus from {OPUS_LIB_PATH}: {e}")
+def _opus_candidates() -> List[str]:
+    # OPUS_LIB_PATH로 직접 지정 가능. 없으면 시스템 라이브러리 검색 결과 → 플랫폼별 흔한 위치 순.
+    candidates = [os.getenv("OPUS_LIB_PATH"), ctypes.util.find_library("opus")]
+    if sys.platform == "darwin":
+        candidates += ["/opt/homebrew/lib/libopus.dylib", "/usr/local/lib/libopus.dylib"]
+    elif sys.platform.startswith("linux"):
+        candidates += ["libopus.so.0"]
+    return [c for c in dict.fromkeys(candidates) if c]
+
+def load_opus():
+    if discord.opus.is_loaded():
+        return
+    for path in _opus_candidates():
+        try:
+            discord.opus.load_opus(path)
+            print(f"[OPUS] Loaded opus from {path}")
+            return
+        except OSError as e:
+            print(f"[OPUS] Failed to load opus from {path}: {e}")
+    # Windows는 discord.py에 포함된 opus를 음성 연결 시 스스로 불러온다
+    print("[OPUS] libopus not found here → discord.py 기본 탐색에 맡김 (OPUS_LIB_PATH로 지정 가능)")
+
+if not IN_EXTRACT_WORKER:
+    load_opus()
+    boot_mark("opus")
 
 # =========================
 # 상수 / 정규식 / 이모지
 # =========================
-YOUTUBE_URL_REGEX = re.compile(r'^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+', re.IGNORECASE)
+YOUTUBE_URL_REGEX = re.compile(r'^(https?://)?(www\.|m\.|music\.)?(youtube\.com|youtu\.be)/.+', re.IGNORECASE)
+YOUTUBE_VIDEO_ID_REGEX = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([0-9A-Za-z_-]{11})")
 EMOJI_CHOICES = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣"]
 
-# 간단 캐시: 같은 키워드 반복 요청 시 바로 응답
-track_cache: Dict[str, dict] = {}
 
 # =========================
 # Intents & Bot
@@ -40,152 +132,2102 @@ intents.message_content = True
 intents.reactions = True
 intents.voice_states = True
 
+# 워커에서도 만들어지지만(명령 데코레이터가 필요) 연결/토큰 없이 객체만 만든다.
 bot = commands.Bot(
     command_prefix=commands.when_mentioned_or("!"),
     description="디스코드 음악 봇 (쿠키/클라이언트 폴백/검색 폴백 내장)",
     intents=intents,
 )
 
+# =========================
+# 재생 방식
+# =========================
+# opus(기본): ffmpeg가 Opus로 내보내고 discord.py는 패킷을 그대로 전송(파이썬 쪽 PCM 볼륨/인코딩 없음).
+#   원본이 opus이고 PLAYBACK_VOLUME=1.0이면 재인코딩 없이 codec copy(패스스루).
+# pcm: 예전 방식(FFmpegPCMAudio + PCMVolumeTransformer, 파이썬 스레드에서 20ms마다 Opus 인코딩).
+PLAYBACK_MODE = os.getenv("PLAYBACK_MODE", "opus")
+PLAYBACK_VOLUME = float(os.getenv("PLAYBACK_VOLUME", "0.3"))  # 기본 볼륨 30% (원하면 0.1~0.5, 1.0이면 원음)
+# opus 모드는 패스스루가 되도록 webm/opus 포맷을 먼저 고른다
+AUDIO_FORMAT = (
+    "bestaudio[acodec=opus]/bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio/best"
+    if PLAYBACK_MODE == "opus" else "bestaudio[ext=m4a]/bestaudio/best"
+)
+
+# =========================
+# 추출 설정 (시작 시 한 번 만들고 검증, 쿠키 파일 변경/SIGHUP 때만 다시 읽음)
+# =========================
+class ExtractionConfig:
+    """yt-dlp 추출에 쓰는 환경 설정과 공통 옵션 틀.
+
+    추출 경로(_ydl_opts_base 등)는 이 객체만 읽으므로 요청마다 os.getenv/파일 확인/로그가 없다.
+    reload_extraction_config()가 새 객체로 통째로 바꾼다(generation 증가).
+    """
+
+    def __init__(self, pot_base_url: Optional[str], cookie_path: Optional[str], cookie_merge: bool,
+                 generation: int = 0):
+        self.pot_base_url = pot_base_url
+        self.cookie_path = cookie_path
+        self.cookie_merge = cookie_merge
+        self.cookie_mtime = self._mtime(cookie_path)
+        self.generation = generation
+        self._opts: Dict[bool, Dict[str, object]] = {}  # POT 사용 여부 → 공통 옵션 틀
+
+    @classmethod
+    def from_env(cls, generation: int = 0) -> "ExtractionConfig":
+        return cls(
+            pot_base_url=os.getenv("BGUTIL_POT_BASE_URL") or None,
+            cookie_path=os.getenv("YTDLP_COOKIES") or None,
+            cookie_merge=os.getenv("YTDLP_COOKIES_MERGE", "0") == "1",
+            generation=generation,
+        )
+
+    @staticmethod
+    def _mtime(path: Optional[str]) -> Optional[float]:
+        if not path:
+            return None
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def cookie_file_changed(self) -> bool:
+        return self.cookie_path is not None and self._mtime(self.cookie_path) != self.cookie_mtime
+
+    def validate(self) -> List[str]:
+        """잘못된 값은 경고와 함께 꺼 둔다. 경고 목록을 반환."""
+        problems = []
+        if self.pot_base_url:
+            parts = urlsplit(self.pot_base_url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                problems.append(f"BGUTIL_POT_BASE_URL이 http(s) URL이 아님 → POT 끔: {self.pot_base_url}")
+                self.pot_base_url = None
+        if self.cookie_path and self.cookie_mtime is None:
+            problems.append(f"YTDLP_COOKIES 파일 없음 → 쿠키 없이 추출 (생기면 자동 반영): {self.cookie_path}")
+        for problem in problems:
+            print(f"[CONFIG] {problem}")
+        return problems
+
+    def summary(self) -> str:
+        return (
+            f"pot={self.pot_base_url or '-'} cookies={self.cookie_path or '-'} "
+            f"(exists={self.cookie_mtime is not None}, merge={self.cookie_merge}) gen={self.generation}"
+        )
+
+    def base_opts(self, pot_ok: bool) -> Dict[str, object]:
+        """공통 옵션 틀(호출마다 사본을 만들어 쓸 것)."""
+        opts = self._opts.get(pot_ok)
+        if opts is None:
+            opts = {
+                "format": AUDIO_FORMAT,
+                "noplaylist": True,
+                "quiet": True,
+                "skip_download": True,
+                "retries": 3,
+                "file_access_retries": 2,
+                "fragment_retries": 3,
+                "geo_bypass": True,
+                # 필요 시 HTTP 헤더 등 추가 가능
+                # "http_headers": {...}
+            }
+            # PO Token 공급자(bgutil HTTP 서버)를 가리키도록 설정.
+            # 데이터센터 IP(EC2)에서 'Sign in to confirm you're not a bot' 우회에 필요.
+            if self.pot_base_url and pot_ok:
+                opts["extractor_args"] = {
+                    "youtubepot-bgutilhttp": {"base_url": [self.pot_base_url]},
+                }
+            elif self.pot_base_url:
+                # 공급자 장애(브레이커 open): 토큰 요청에서 매번 타임아웃 나지 않게 POT 없이 추출
+                opts["extractor_args"] = {"youtube": {"fetch_pot": ["never"]}}
+            self._opts[pot_ok] = opts
+        return opts
+
+extraction_config = ExtractionConfig.from_env()
+extraction_config.validate()
+if not IN_EXTRACT_WORKER:
+    print(f"[CONFIG] {extraction_config.summary()}")
+
+# =========================
+# POT 공급자 감시 (keep-alive 연결 + 헬스 체크 + 서킷 브레이커)
+# =========================
+POT_CLOSED = "closed"        # 정상: POT 사용
+POT_OPEN = "open"            # 장애: POT 없이 추출(저하 모드)
+POT_HALF_OPEN = "half_open"  # 회복 확인 중: 아직 저하 모드, 연속 성공하면 closed
+
+class PotProviderSupervisor:
+    """bgutil POT 서버(사이드카)의 상태를 주기적으로 /ping 해서 추적하는 서킷 브레이커.
+
+    연속 threshold번 실패하면 open → 추출은 POT를 받지 않는 저하 모드(fetch_pot=never)로 돌아
+    죽은 사이드카를 기다리지 않는다. open에서 ping이 성공하면 half_open, recover번 연속 성공하면
+    closed로 복귀. POT 사용 여부가 바뀌면 YoutubeDL 풀을 비워 새 옵션으로 다시 만든다.
+    HTTP 연결은 keep-alive로 재사용한다(끊겨 있으면 한 번 다시 연결).
+    """
+
+    def __init__(self, base_url: str, interval: float = 15.0, threshold: int = 3, recover: int = 2,
+                 timeout: float = 5.0, history: int = 200):
+        self.base_url = base_url.rstrip("/")
+        parts = urlsplit(self.base_url)
+        self._https = parts.scheme == "https"
+        self._host = parts.hostname or "localhost"
+        self._port = parts.port
+        self._prefix = parts.path.rstrip("/")
+        self.interval = interval
+        self.threshold = threshold
+        self.recover = recover
+        self.timeout = timeout
+        self._conn: Optional["http.client.HTTPConnection"] = None
+        self._conn_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.state = POT_CLOSED
+        self.failures = 0          # 연속 실패
+        self.successes = 0         # half_open에서 연속 성공
+        self.state_changes = 0
+        self.last_error: Optional[str] = None
+        self._results: deque = deque(maxlen=history)    # 최근 ping 성공 여부
+        self._latencies: deque = deque(maxlen=history)  # 성공한 ping 지연(초)
+
+    @property
+    def pot_ok(self) -> bool:
+        return self.state == POT_CLOSED
+
+    def _connect(self) -> "http.client.HTTPConnection":
+        import http.client
+        cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+        return cls(self._host, self._port, timeout=self.timeout)
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        """공급자에 HTTP 요청(블로킹). 재사용하던 연결이 서버 쪽에서 끊겼으면 새 연결로 한 번 더."""
+        import http.client
+        headers = dict(headers or {})
+        with self._conn_lock:
+            for attempt in range(2):
+                reused = self._conn is not None
+                if self._conn is None:
+                    self._conn = self._connect()
+                try:
+                    self._conn.request(method, self._prefix + path, body=body, headers=headers)
+                    resp = self._conn.getresponse()
+                    data = resp.read()
+                    if resp.will_close:
+                        self._conn.close()
+                        self._conn = None
+                    return resp.status, data
+                except (http.client.HTTPException, OSError):
+                    self._conn.close()
+                    self._conn = None
+                    if not reused or attempt == 1:
+                        raise
+        raise RuntimeError("unreachable")
+
+    def ping(self) -> float:
+        """/ping 한 번(블로킹). 지연(초)을 돌려주고, 실패하면 예외."""
+        t0 = time.monotonic()
+        status, _ = self.request("GET", "/ping")
+        if status != 200:
+            raise RuntimeError(f"/ping HTTP {status}")
+        return time.monotonic() - t0
+
+    async def probe(self) -> bool:
+        try:
+            latency = await asyncio.to_thread(self.ping)
+        except Exception as e:
+            self.record_failure(e)
+            return False
+        self.record_success(latency)
+        return True
+
+    def record_success(self, latency: float):
+        self._results.append(True)
+        self._latencies.append(latency)
+        self.failures = 0
+        if self.state == POT_OPEN:
+            self.successes = 1
+            self._set_state(POT_HALF_OPEN if self.recover > 1 else POT_CLOSED)
+        elif self.state == POT_HALF_OPEN:
+            self.successes += 1
+            if self.successes >= self.recover:
+                self._set_state(POT_CLOSED)
+
+    def record_failure(self, err: Exception):
+        self._results.append(False)
+        self.last_error = str(err)[:200]
+        self.failures += 1
+        self.successes = 0
+        if self.state == POT_HALF_OPEN or (self.state == POT_CLOSED and self.failures >= self.threshold):
+            self._set_state(POT_OPEN)
+
+    def _set_state(self, state: str):
+        was_ok = self.pot_ok
+        reason = f", last_error={self.last_error}" if state == POT_OPEN else ""
+        print(f"[POT] {self.state} → {state} ({self.base_url}{reason})")
+        self.state = state
+        self.state_changes += 1
+        if was_ok != self.pot_ok:
+            print(f"[POT] {'정상 모드(POT 사용)' if self.pot_ok else '저하 모드(fetch_pot=never)'}로 전환 → YoutubeDL 풀 재생성")
+            ydl_pool.invalidate()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def _loop(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> str:
+        total = len(self._results)
+        avail = f"{100.0 * sum(self._results) / total:.0f}%" if total else "-"
+        q = ExtractionExecutor._quantile
+        text = (
+            f"상태 {self.state} (연속 실패 {self.failures}, 전환 {self.state_changes}회)\n"
+            f"가용률 {avail} (최근 {total}회), 지연 p50 {q(self._latencies, 0.5) * 1000:.0f}ms · "
+            f"p90 {q(self._latencies, 0.9) * 1000:.0f}ms"
+        )
+        if self.last_error and not self.pot_ok:
+            text += f"\n마지막 오류: {self.last_error}"
+        return text
+
+# compose 사이드카 서비스명 기준 기본값(http://bgutil-provider:4416). 없으면 POT 없이 동작.
+# 공급자 주소는 재시작해야 바뀐다(설정 다시 읽기는 쿠키 쪽만 해당).
+pot_supervisor: Optional[PotProviderSupervisor] = None
+if extraction_config.pot_base_url:
+    pot_supervisor = PotProviderSupervisor(
+        extraction_config.pot_base_url,
+        interval=float(os.getenv("POT_PROBE_INTERVAL", "15")),
+        threshold=int(os.getenv("POT_BREAKER_THRESHOLD", "3")),
+        recover=int(os.getenv("POT_BREAKER_RECOVER", "2")),
+        timeout=float(os.getenv("POT_TIMEOUT", "5")),
+    )
+
+# 프로세스 워커는 감시 작업이 없으므로 메인 프로세스의 판단을 작업마다 받아 여기에 둔다(_process_job)
+_pot_ok_override: Optional[bool] = None
+
+def pot_available() -> bool:
+    """지금 추출에 POT 공급자를 써도 되는지(브레이커가 닫혀 있는지)."""
+    if _pot_ok_override is not None:
+        return _pot_ok_override
+    return pot_supervisor is None or pot_supervisor.pot_ok
+
+# =========================
+# PO 토큰 / visitor_data 캐시 (TTL + 만료 전 미리 갱신)
+# =========================
+def _parse_pot_expiry(value) -> Optional[float]:
+    """공급자 응답의 만료 시각(ISO 문자열 또는 epoch 초/밀리초) → epoch 초."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000.0 if value > 1e12 else float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+class PoTokenCache:
+    """bgutil 공급자에서 받은 PO 토큰과 그 토큰이 묶인 visitor_data를 context별로 TTL 동안 재사용한다.
+
+    context가 "gvs:<data_sync_id>"이면(쿠키 로그인 세션) 그 계정 세션에 묶인 토큰을 받는다.
+
+    추출마다 사이드카에 토큰을 요청하는 대신, 캐시된 토큰을 extractor_args(po_token/visitor_data)로
+    직접 넘긴다. 만료 refresh_lead초 전부터는 기존 토큰을 계속 쓰면서 백그라운드 스레드로 새 토큰을 받는다.
+    스레드 안전(추출 스레드에서 호출). 프로세스 백엔드에서는 워커마다 자기 캐시를 가진다.
+    """
+
+    def __init__(self, supervisor: PotProviderSupervisor, ttl: float = 21600.0, refresh_lead: float = 1800.0,
+                 retry_after: float = 30.0):
+        self._supervisor = supervisor
+        self.ttl = ttl
+        self.refresh_lead = refresh_lead
+        self.retry_after = retry_after
+        self._entries: Dict[str, dict] = {}  # context -> {"po_token", "visitor_data", "expires_at", "refresh_at"}
+        self._failed_at: Dict[str, float] = {}
+        self._refreshing: set = set()
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.issued = 0
+        self.failures = 0
+
+    def _fetch(self, context: str) -> dict:
+        # content_binding 없이 요청하면 공급자가 visitor_data를 새로 만들고 거기에 묶인 토큰을 준다.
+        # 로그인 세션이면 data_sync_id를 content_binding으로 넘겨 그 세션에 묶인 토큰을 받는다.
+        _, _, binding = context.partition(":")
+        body = json.dumps({"content_binding": binding}).encode() if binding else b"{}"
+        status, data = self._supervisor.request(
+            "POST", "/get_pot", body=body, headers={"Content-Type": "application/json"},
+        )
+        if status != 200:
+            raise RuntimeError(f"/get_pot HTTP {status}")
+        payload = json.loads(data)
+        # 공급자 버전에 따라 camelCase/snake_case 둘 다 온다
+        token = payload.get("poToken") or payload.get("po_token")
+        binding = payload.get("contentBinding") or payload.get("content_binding")
+        if not token or not binding:
+            raise RuntimeError(f"/get_pot 응답에 토큰/바인딩 없음: {sorted(payload)}")
+        now = time.time()
+        expires_at = _parse_pot_expiry(payload.get("expiresAt") or payload.get("expires_at"))
+        expires_at = min(expires_at, now + self.ttl) if expires_at else now + self.ttl
+        # 수명이 짧은 토큰이면 수명의 절반이 지났을 때 갱신(매 요청마다 갱신하지 않게)
+        refresh_at = expires_at - min(self.refresh_lead, (expires_at - now) / 2)
+        return {"po_token": token, "visitor_data": binding, "expires_at": expires_at, "refresh_at": refresh_at}
+
+    def get(self, context: str = "gvs") -> Optional[dict]:
+        """유효한 토큰 항목. 없으면 받아 오고(블로킹), 받을 수 없으면 None(→ 플러그인 경로로 추출)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(context)
+            if entry is not None and entry["expires_at"] > now:
+                self.hits += 1
+                if now >= entry["refresh_at"]:
+                    self._refresh_in_background(context)
+                return entry
+            self.misses += 1
+            failed_at = self._failed_at.get(context)
+        if failed_at and now - failed_at < self.retry_after:
+            return None
+        with self._fetch_lock:
+            # 기다리는 동안 다른 스레드가 받아 왔으면 그것을 쓴다
+            with self._lock:
+                entry = self._entries.get(context)
+            if entry is not None and entry["expires_at"] > time.time():
+                return entry
+            return self._refresh(context)
+
+    def _refresh(self, context: str) -> Optional[dict]:
+        try:
+            entry = self._fetch(context)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+                self._failed_at[context] = time.time()
+            print(f"[POT] PO token fetch failed ({context}): {e}")
+            return None
+        with self._lock:
+            self._entries[context] = entry
+            self._failed_at.pop(context, None)
+            self.issued += 1
+        print(f"[POT] PO token cached ({context}), valid {int(entry['expires_at'] - time.time())}s")
+        return entry
+
+    def _refresh_in_background(self, context: str):
+        # self._lock을 잡은 상태로 호출된다
+        if context in self._refreshing:
+            return
+        self._refreshing.add(context)
+
+        def _run():
+            try:
+                with self._fetch_lock:
+                    self._refresh(context)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(context)
+
+        threading.Thread(target=_run, name=f"pot-refresh-{context}", daemon=True).start()
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> str:
+        with self._lock:
+            expiries = [e["expires_at"] for e in self._entries.values()]
+        left = f"{len(expiries)}개, {max(0, int(min(expiries) - time.time())) // 60}분 남음" if expiries else "없음"
+        return f"적중 {self.hits} / 미스 {self.misses}, 발급 {self.issued} / 실패 {self.failures}, 토큰 {left}"
+
+# POT_TOKEN_CACHE=0이면 예전처럼 추출마다 플러그인이 공급자에게 토큰을 받는다
+po_token_cache: Optional[PoTokenCache] = None
+if pot_supervisor is not None and os.getenv("POT_TOKEN_CACHE", "1") == "1":
+    po_token_cache = PoTokenCache(
+        pot_supervisor,
+        ttl=float(os.getenv("POT_TOKEN_TTL", "21600")),
+        refresh_lead=float(os.getenv("POT_TOKEN_REFRESH_LEAD", "1800")),
+    )
+
 # =========================
 # yt-dlp 공통 옵션 (쿠키는 환경변수 YTDLP_COOKIES에서만)
 # =========================
 def _ydl_opts_base(default_search: Optional[str] = None) -> Dict[str, object]:
-    opts: Dict[str, object] = {
-        "format": "bestaudio[ext=m4a]/bestaudio/best",
-        "noplaylist": True,
-        "quiet": True,
-        "skip_download": True,
-        "retries": 3,
-        "file_access_retries": 2,
-        "fragment_retries": 3,
-        "geo_bypass": True,
-        # 필요 시 HTTP 헤더 등 추가 가능
-        # "http_headers": {...}
-    }
+    """extraction_config의 공통 옵션 틀 사본 (+ default_search)."""
+    opts = copy.deepcopy(extraction_config.base_opts(pot_available()))
     if default_search:
         opts["default_search"] = default_search
 
-    # PO Token 공급자(bgutil HTTP 서버)를 가리키도록 설정.
-    # 데이터센터 IP(EC2)에서 'Sign in to confirm you're not a bot' 우회에 필요.
-    # compose 사이드카 서비스명 기준 기본값(http://bgutil-provider:4416).
-    pot_base = os.getenv("BGUTIL_POT_BASE_URL")
-    if pot_base:
-        opts["extractor_args"] = {
-            "youtubepot-bgutilhttp": {"base_url": [pot_base]},
-        }
-        print(f"[YTDLP] Using bgutil POT provider: {pot_base}")
-
-    cookiefile = os.getenv("YTDLP_COOKIES")
-    if cookiefile and os.path.exists(cookiefile):
-        opts["cookiefile"] = cookiefile
-        print(f"[YTDLP] Using cookiefile from env: {cookiefile}")
-    else:
-        print(f"[YTDLP] No cookies loaded. YTDLP_COOKIES={cookiefile} exists={os.path.exists(cookiefile) if cookiefile else None}")
+    # 쿠키는 cookiefile 옵션으로 넘기지 않는다. yt-dlp가 close() 시 파일에 다시 쓰기 때문.
+    # 대신 shared_cookies(메모리 jar)의 뷰를 인스턴스마다 꽂아 준다(_PooledYDL 참고).
     return opts
 
+# =========================
+# 공유 쿠키 jar (파일은 한 번만 파싱, 인스턴스는 copy-on-write 뷰)
+# =========================
+_cow_jar_class = None
+
+def _cow_cookie_jar_class():
+    """YoutubeDLCookieJar를 상속하므로 yt_dlp를 import한 뒤(처음 쓸 때) 클래스를 만든다."""
+    global _cow_jar_class
+    if _cow_jar_class is not None:
+        return _cow_jar_class
+    get_yt_dlp()
+    from yt_dlp.cookies import YoutubeDLCookieJar
+
+    class _CowCookieJar(YoutubeDLCookieJar):
+        """공유 쿠키 dict를 그대로 참조하다가, 처음 쓰기(set/clear)가 일어날 때만 자기 사본을 만든다."""
+
+        def __init__(self, cookies: dict):
+            super().__init__()
+            self._cookies = cookies
+            self._owned = False
+            self.dirty = False
+
+        def _materialize(self):
+            if not self._owned:
+                self._cookies = {d: {p: dict(names) for p, names in paths.items()}
+                                 for d, paths in self._cookies.items()}
+                self._owned = True
+
+        def set_cookie(self, cookie):
+            with self._cookies_lock:
+                self._materialize()
+                super().set_cookie(cookie)
+                self.dirty = True
+
+        def clear(self, domain=None, path=None, name=None):
+            with self._cookies_lock:
+                self._materialize()
+                super().clear(domain, path, name)
+                self.dirty = True
+
+        def save(self, *args, **kwargs):
+            # 원본 파일(:ro 마운트)에는 절대 쓰지 않는다. 변경분은 메모리에만 남는다.
+            pass
+
+    _cow_jar_class = _CowCookieJar
+    return _cow_jar_class
+
+class SharedCookieJar:
+    """YTDLP_COOKIES 파일을 한 번만 파싱해 메모리에 보관하는 쿠키 저장소.
+
+    추출 인스턴스마다 view()로 copy-on-write 뷰를 받아 쓰므로 파일 복사/재파싱이 없다.
+    YTDLP_COOKIES_MERGE=1이면 추출 중 유튜브가 갱신한 쿠키를 merge()로 공유 jar에 합친다
+    (메모리에만 반영, 파일 쓰기 없음).
+    """
+
+    def __init__(self, path: str, merge: bool = False):
+        self.path = path
+        self.merge_enabled = merge
+        self._lock = threading.Lock()
+        get_yt_dlp()
+        from yt_dlp.cookies import YoutubeDLCookieJar
+        jar = YoutubeDLCookieJar(path)
+        jar.load()
+        self._cookies = jar._cookies
+        self.count = len(jar)
+
+    def view(self):
+        """copy-on-write 쿠키 jar(_cow_cookie_jar_class) 하나를 만든다."""
+        with self._lock:
+            return _cow_cookie_jar_class()(self._cookies)
+
+    def merge(self, jar):
+        """jar의 변경분을 공유 jar에 합친다. 기존 뷰는 이전 스냅샷을 계속 본다."""
+        if not (self.merge_enabled and jar.dirty):
+            return
+        with self._lock:
+            merged = {d: {p: dict(names) for p, names in paths.items()} for d, paths in self._cookies.items()}
+            for cookie in jar:
+                merged.setdefault(cookie.domain, {}).setdefault(cookie.path, {})[cookie.name] = copy.copy(cookie)
+            self._cookies = merged
+        jar.dirty = False
+
+_shared_cookies: Optional[SharedCookieJar] = None
+_shared_cookies_lock = threading.Lock()
+_shared_cookies_loaded = False
+
+def get_shared_cookies() -> Optional[SharedCookieJar]:
+    """YTDLP_COOKIES를 처음 필요할 때 한 번만 읽는다. 없거나 읽기 실패면 None."""
+    global _shared_cookies, _shared_cookies_loaded
+    with _shared_cookies_lock:
+        if _shared_cookies_loaded:
+            return _shared_cookies
+        _shared_cookies_loaded = True
+        config = extraction_config
+        if config.cookie_path and config.cookie_mtime is not None:
+            try:
+                _shared_cookies = SharedCookieJar(config.cookie_path, merge=config.cookie_merge)
+                print(f"[YTDLP] Loaded {_shared_cookies.count} cookies from env: {config.cookie_path}")
+            except Exception as e:
+                print(f"[YTDLP] Failed to load cookiefile {config.cookie_path}: {e}")
+        else:
+            print(f"[YTDLP] No cookies loaded. YTDLP_COOKIES={config.cookie_path} exists={config.cookie_mtime is not None}")
+        return _shared_cookies
+
+def reset_shared_cookies():
+    """다음 get_shared_cookies() 때 쿠키 파일을 다시 읽게 한다. 이미 만든 뷰는 이전 쿠키를 계속 쓴다."""
+    global _shared_cookies, _shared_cookies_loaded
+    with _shared_cookies_lock:
+        _shared_cookies = None
+        _shared_cookies_loaded = False
+
 # 여러 클라이언트로 재시도 (일부 영상이 특정 클라에서만 막히는 대응)
 # 주의: ios/android 클라이언트는 쿠키를 무시(android는 'does not support cookies')하므로 제외.
 # 2026년 기준 web/mweb는 SABR로 막혀 'Only images are available'(포맷 없음)이 잦음.
 # tv(TV HTML5) 클라이언트가 쿠키+POT와 함께 실제 포맷을 안정적으로 반환 → 최우선.
 PLAYER_CLIENTS = (["tv"], ["web_safari"], ["mweb"])
 
+def _ydl_opts_for_client(client: List[str], default_search: Optional[str] = None, flat: bool = False) -> Dict[str, object]:
+    """공통 옵션에 player_client 지정을 덧붙인 옵션. flat이면 검색 결과 목록만(포맷 해석 없이) 가져온다."""
+    ydl_opts = _ydl_opts_base(default_search=default_search)
+    if flat:
+        ydl_opts["extract_flat"] = "in_playlist"
+    ea = dict(ydl_opts.get("extractor_args") or {})
+    ytargs = dict(ea.get("youtube") or {})
+    ytargs["player_client"] = client
+    ea["youtube"] = ytargs
+    ydl_opts["extractor_args"] = ea
+    return ydl_opts
+
+# =========================
+# YoutubeDL 인스턴스 풀 (player_client별 재사용)
+# =========================
+class _PooledYDL:
+    """풀에 보관되는 YoutubeDL 1개 + 그 인스턴스 전용 쿠키 뷰."""
+
+    def __init__(self, client: List[str], default_search: Optional[str], flat: bool):
+        self.ydl = get_yt_dlp().YoutubeDL(_ydl_opts_for_client(client, default_search, flat))
+        self.generation = 0
+        self.cookies = None
+        self.shared = get_shared_cookies()  # 뷰를 받은 공유 jar (설정을 다시 읽으면 다른 jar로 바뀐다)
+        shared = self.shared
+        if shared is not None:
+            # cookiejar는 첫 요청 때 만들어지는 지연 속성 → 요청 전에 뷰로 교체한다.
+            self.cookies = shared.view()
+            self.ydl.cookiejar = self.cookies
+            self.ydl.__dict__.pop("_request_director", None)
+
+    def after_use(self, pool_generation: int):
+        """뷰의 변경분을 뷰를 받은 jar에만 합친다. 그 사이 설정을 다시 읽어 jar/풀 세대가 바뀌었으면
+        (쿠키 파일 교체·삭제) 예전 쿠키로 새 jar를 덮어쓰지 않도록 버린다."""
+        if self.cookies is None or self.generation != pool_generation:
+            return
+        with _shared_cookies_lock:
+            current = _shared_cookies if _shared_cookies_loaded else None
+        if current is self.shared:
+            self.shared.merge(self.cookies)
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception as e:
+            print(f"[YTDLP] pool instance close failed: {e}")
+
+class YDLPool:
+    """player_client/검색 모드별로 예열된 YoutubeDL 인스턴스를 재사용하는 풀.
+
+    YoutubeDL 생성 시의 extractor 등록, 플러그인(bgutil POT) 로드, player JS/
+    n-challenge 캐시를 매 요청마다 다시 하지 않도록 인스턴스를 오래 유지한다.
+    YoutubeDL은 스레드 안전하지 않으므로 한 인스턴스는 동시에 한 추출에만 대여하고,
+    대여 중인 인스턴스가 모자라면 새로 만든다(반납 시 max_idle 초과분은 폐기).
+    """
+
+    def __init__(self, max_idle: int = 4):
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[Tuple[str, ...], Optional[str], bool], List[_PooledYDL]] = {}
+        self._max_idle = max_idle
+        self.generation = 0  # invalidate()마다 증가. 이전 세대 인스턴스는 반납 시 폐기
+        self.created = 0
+        self.reused = 0
+
+    @contextlib.contextmanager
+    def lease(self, client: List[str], default_search: Optional[str] = None, flat: bool = False):
+        key = (tuple(client), default_search, flat)
+        with self._lock:
+            idle = self._idle.get(key)
+            entry = idle.pop() if idle else None
+            if entry is not None:
+                self.reused += 1
+            generation = self.generation
+        if entry is None:
+            # 생성은 느리므로 락 밖에서 (동시 요청이 서로 막지 않도록)
+            entry = _PooledYDL(client, default_search, flat)
+            entry.generation = generation
+            with self._lock:
+                self.created += 1
+        try:
+            yield entry.ydl
+        finally:
+            try:
+                entry.after_use(self.generation)
+            except Exception as e:
+                # 쿠키 합치기 실패가 추출 결과를 덮거나 반납을 건너뛰지 않게
+                print(f"[YTDLP] cookie merge failed: {e}")
+            self._release(key, entry)
+
+    def _release(self, key, entry: _PooledYDL):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if entry.generation == self.generation and len(idle) < self._max_idle:
+                idle.append(entry)
+                return
+        entry.close()
+
+    def close_all(self):
+        with self._lock:
+            entries = [e for idle in self._idle.values() for e in idle]
+            self._idle.clear()
+        for e in entries:
+            e.close()
+
+    def invalidate(self):
+        """공통 옵션(POT 모드 등)이 바뀌었을 때: 놀고 있는 인스턴스는 닫고, 대여 중인 것은 반납 때 버린다."""
+        with self._lock:
+            self.generation += 1
+        self.close_all()
+
+ydl_pool = YDLPool(max_idle=int(os.getenv("YTDLP_POOL_MAX_IDLE", "4")))
+atexit.register(ydl_pool.close_all)
+
+def reload_extraction_config(reason: str, generation: Optional[int] = None):
+    """설정을 다시 만들고 쿠키 jar/PO 토큰 캐시/YoutubeDL 풀을 비운다(다음 추출부터 새 설정).
+    generation: 프로세스 워커가 메인 프로세스의 세대 번호를 따라갈 때 지정."""
+    global extraction_config
+    if generation is None:
+        generation = extraction_config.generation + 1
+    config = ExtractionConfig.from_env(generation)
+    config.validate()
+    extraction_config = config
+    reset_shared_cookies()
+    if po_token_cache is not None:
+        po_token_cache.invalidate()
+    ydl_pool.invalidate()
+    print(f"[CONFIG] reloaded ({reason}): {config.summary()}")
+
+# =========================
+# player_client 적응형 순서 (최근 성공률/지연 기반)
+# =========================
+class ClientScoreboard:
+    """player_client별 최근 성공/실패와 지연을 슬라이딩 윈도우로 기록해 시도 순서를 정한다.
+
+    - 오래된 기록일수록 가중치가 반감기(half_life)마다 절반으로 줄어든다(decay).
+    - 1차 기준은 감쇠 가중 성공률(베이즈 사전 1/2, rate_step 단위로 묶음). 기록이 없는 클라이언트는
+      사전값 1/2이라 성공이 실패보다 많은 클라이언트를 앞지르지 못하고, 같으면 기본 순서를 따른다.
+    - 2차 기준은 성공한 시도만의 감쇠 가중 평균 지연(빠른 실패가 지연을 좋아 보이게 하지 않도록).
+    - explore 확률로 1순위가 아닌 클라이언트를 맨 앞에 세워, 죽었다 살아난
+      클라이언트가 새 성공 기록으로 다시 1순위를 되찾을 수 있게 한다.
+    """
+
+    def __init__(self, clients, window: int = 50, window_sec: float = 1800.0,
+                 half_life: float = 300.0, rate_step: float = 0.05, explore: float = 0.05):
+        self._clients = [tuple(c) for c in clients]
+        self._lock = threading.Lock()
+        self._window_sec = window_sec
+        self._half_life = half_life
+        self._rate_step = rate_step
+        self._explore = explore
+        # client -> deque[(기록 시각, 성공 여부, 지연초)]
+        self._samples: Dict[Tuple[str, ...], deque] = {c: deque(maxlen=window) for c in self._clients}
+
+    def record(self, client, ok: bool, latency: float):
+        with self._lock:
+            self._samples[tuple(client)].append((time.monotonic(), ok, latency))
+
+    def _score(self, client: Tuple[str, ...], now: float) -> Tuple[float, Optional[float]]:
+        """(감쇠 가중 성공률, 성공 시도의 평균 지연 또는 None)."""
+        samples = self._samples[client]
+        while samples and now - samples[0][0] > self._window_sec:
+            samples.popleft()
+        w_total = w_ok = w_lat = 0.0
+        for ts, ok, latency in samples:
+            w = 0.5 ** ((now - ts) / self._half_life)
+            w_total += w
+            if ok:
+                w_ok += w
+                w_lat += w * latency
+        rate = (w_ok + 1.0) / (w_total + 2.0)
+        avg_latency = (w_lat / w_ok) if w_ok > 0 else None
+        return rate, avg_latency
+
+    def _rank_key(self, client: Tuple[str, ...], score: Tuple[float, Optional[float]]):
+        rate, latency = score
+        # 성공률이 비슷한(같은 칸) 클라이언트끼리만 지연으로 가르고, 그래도 같으면 기본 순서
+        return (-round(rate / self._rate_step), latency if latency is not None else float("inf"),
+                self._clients.index(client))
+
+    def order(self) -> List[List[str]]:
+        """이번 호출에서 시도할 player_client 순서. 점수가 같으면 기본 순서를 유지."""
+        now = time.monotonic()
+        with self._lock:
+            scores = {c: self._score(c, now) for c in self._clients}
+        ranked = sorted(self._clients, key=lambda c: self._rank_key(c, scores[c]))
+        if len(ranked) > 1 and random.random() < self._explore:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return [list(c) for c in ranked]
+
+    def latency_quantile(self, client, q: float = 0.9) -> Optional[float]:
+        """최근 성공 지연의 q-분위수. 기록이 없으면 None."""
+        with self._lock:
+            lat = sorted(l for _, ok, l in self._samples[tuple(client)] if ok)
+        if not lat:
+            return None
+        return lat[min(int(q * len(lat)), len(lat) - 1)]
+
+    def snapshot(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        with self._lock:
+            out = {}
+            for c in self._clients:
+                rate, latency = self._score(c, now)
+                samples = self._samples[c]
+                ok = sum(1 for _, o, _ in samples if o)
+                out[",".join(c)] = {
+                    "score": round(rate, 3), "latency": None if latency is None else round(latency, 2),
+                    "ok": ok, "fail": len(samples) - ok,
+                }
+            return out
+
+client_scores = ClientScoreboard(
+    PLAYER_CLIENTS,
+    half_life=float(os.getenv("YTDLP_CLIENT_HALF_LIFE", "300")),
+    explore=float(os.getenv("YTDLP_CLIENT_EXPLORE", "0.05")),
+)
+
+# 헤지(hedged) 모드: 1순위 클라이언트가 지연(기본: 최근 p90) 안에 답하지 않으면
+# 다음 클라이언트를 병렬로 띄워 먼저 성공한 결과를 쓴다. 데이터센터 IP에서
+# 느린 실패 3번이 직렬로 쌓여 첫 소리까지 오래 걸리는 것을 막기 위함.
+YTDLP_HEDGE = os.getenv("YTDLP_HEDGE", "0") == "1"
+YTDLP_HEDGE_DELAY = os.getenv("YTDLP_HEDGE_DELAY", "auto")  # 초 단위 숫자 또는 auto(p90)
+HEDGE_DELAY_DEFAULT = 4.0
+HEDGE_DELAY_MIN, HEDGE_DELAY_MAX = 1.0, 15.0
+_hedge_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=len(PLAYER_CLIENTS) * 4, thread_name_prefix="ytdlp-hedge"
+)
+
+# 동시에 도는 yt-dlp 추출 시도 수의 상한(순차/헤지/헤지에서 진 뒤에도 계속 도는 시도 모두 포함).
+# 실행기 자리(EXTRACT_WORKERS)는 요청 단위라 헤지 시도까지는 묶지 못하므로 시도마다 이 자리를 잡는다.
+# 헤지 시도는 자리가 비어 있을 때만 띄운다. 프로세스 백엔드는 워커 시작 때 공유 세마포어로 바꾼다.
+_attempt_slots = threading.BoundedSemaphore(int(os.getenv("EXTRACT_WORKERS", "4")))
+# 헤지 시작/건너뜀, 재시도·헤지로 더 나간 추출 수 누계. 추출 스레드들이 동시에 올리므로 락으로 보호.
+hedge_counts: Dict[str, int] = {"launched": 0, "skipped": 0, "extra": 0}
+_hedge_counts_lock = threading.Lock()
+# 요청(코디네이터 스레드)마다 첫 시도 외에 추가로 나간 추출 수 → 속도 제한 정산(_counted_call)
+_attempt_local = threading.local()
+
+def _bump_hedge_count(name: str):
+    with _hedge_counts_lock:
+        hedge_counts[name] += 1
+
+def hedge_counts_snapshot() -> Dict[str, int]:
+    with _hedge_counts_lock:
+        return dict(hedge_counts)
+
+def _count_extra_attempt():
+    # 요청별 값은 그 요청의 코디네이터 스레드에서만 읽고 쓰므로 스레드 로컬, 누계만 공유
+    _attempt_local.extra = getattr(_attempt_local, "extra", 0) + 1
+    _bump_hedge_count("extra")
+
+def _hedge_delay(client: List[str]) -> float:
+    """다음 클라이언트를 병렬로 띄우기 전까지 기다릴 시간."""
+    if YTDLP_HEDGE_DELAY != "auto":
+        return float(YTDLP_HEDGE_DELAY)
+    p90 = client_scores.latency_quantile(client, 0.9)
+    if p90 is None:
+        return HEDGE_DELAY_DEFAULT
+    return min(max(p90, HEDGE_DELAY_MIN), HEDGE_DELAY_MAX)
+
+# 쿠키 로그인 세션의 DATASYNC_ID(설정 세대마다 한 번 유튜브 첫 페이지에서 읽음). 로그인 세션의 GVS PO 토큰은
+# visitor_data가 아니라 이 값에 묶인다.
+_DATASYNC_ID_REGEX = re.compile(r'"DATASYNC_ID"\s*:\s*"([^"]+)"')
+_DATASYNC_RETRY_AFTER = 300.0
+_session_sync: Dict[str, object] = {"generation": None, "id": None, "failed_at": 0.0}
+_session_sync_lock = threading.Lock()
+
+def session_data_sync_id(ydl) -> Optional[str]:
+    """쿠키 세션의 data_sync_id. 대여한 인스턴스(쿠키 jar 포함)로 읽고, 실패하면 잠시 뒤 다시 시도."""
+    with _session_sync_lock:
+        if _session_sync["generation"] == extraction_config.generation:
+            if _session_sync["id"] or time.time() - _session_sync["failed_at"] < _DATASYNC_RETRY_AFTER:
+                return _session_sync["id"]
+        try:
+            page = ydl.urlopen("https://www.youtube.com/").read().decode("utf-8", "replace")
+            m = _DATASYNC_ID_REGEX.search(page)
+            if not m:
+                raise RuntimeError("DATASYNC_ID 없음(쿠키가 로그인 세션이 아닐 수 있음)")
+            _session_sync.update(generation=extraction_config.generation, id=m.group(1), failed_at=0.0)
+            print("[POT] 쿠키 세션 data_sync_id 확인 → 세션에 묶인 PO 토큰 사용")
+        except Exception as e:
+            _session_sync.update(generation=extraction_config.generation, id=None, failed_at=time.time())
+            print(f"[POT] 쿠키 세션 data_sync_id를 읽지 못함 → 플러그인 경로로 추출: {e}")
+        return _session_sync["id"]
+
+def _apply_po_token(ydl, client: List[str]):
+    """대여한 인스턴스에 캐시된 PO 토큰을 꽂는다(없으면 지운다 → 플러그인이 공급자에게 요청). POT 저하 모드에서는 쓰지 않는다.
+    쿠키가 없으면 토큰과 그 토큰이 묶인 visitor_data를 함께, 쿠키(로그인 세션)면 data_sync_id에 묶인 토큰만 넘긴다."""
+    entry = None
+    logged_in = False
+    if po_token_cache is not None and pot_available():
+        if get_shared_cookies() is None:
+            entry = po_token_cache.get()
+        else:
+            logged_in = True
+            sync_id = session_data_sync_id(ydl)
+            if sync_id:
+                entry = po_token_cache.get(f"gvs:{sync_id}")
+    ea = dict(ydl.params.get("extractor_args") or {})
+    ytargs = {k: v for k, v in (ea.get("youtube") or {}).items() if k not in ("po_token", "visitor_data", "player_skip")}
+    if entry is not None:
+        ytargs["po_token"] = [f"{c}.gvs+{entry['po_token']}" for c in client]
+        if not logged_in:
+            ytargs["visitor_data"] = [entry["visitor_data"]]
+            # yt-dlp 안내대로 visitor_data 지정 시 웹페이지/설정 요청은 건너뛴다(다른 visitor로 덮이지 않게)
+            ytargs["player_skip"] = ["webpage", "configs"]
+    ea["youtube"] = ytargs
+    ydl.params["extractor_args"] = ea
+
+def _attempt_in_slot(client: List[str], extract_fn, args, default_search: Optional[str]):
+    """미리 잡아 둔 _attempt_slots 자리에서 한 번 시도하고 자리를 돌려준다."""
+    try:
+        return _attempt_client(client, extract_fn, args, default_search)
+    finally:
+        _attempt_slots.release()
+
+def _attempt_client(client: List[str], extract_fn, args, default_search: Optional[str]):
+    """한 player_client로 1회 추출 시도. 결과(성공/실패, 지연)를 client_scores에 기록."""
+    t0 = time.monotonic()
+    try:
+        with ydl_pool.lease(client, default_search) as ydl:
+            _apply_po_token(ydl, client)
+            print(f"[YTDLP] Try player_client={client}")
+            result = extract_fn(ydl, *args)
+    except Exception as e:
+        client_scores.record(client, False, time.monotonic() - t0)
+        print(f"[YTDLP] player_client={client} failed: {e}")
+        raise
+    client_scores.record(client, True, time.monotonic() - t0)
+    return result
+
+def _extract_hedged(order: List[List[str]], extract_fn, args, default_search: Optional[str]):
+    """order 순서로 헤지 추출. 먼저 성공한 결과를 반환하고 나머지는 취소/무시."""
+    pending = set()
+    launched = 0
+    last_err = None
+
+    def launch(blocking: bool) -> bool:
+        nonlocal launched
+        if not _attempt_slots.acquire(blocking=blocking):
+            return False
+        if launched > 0:
+            _count_extra_attempt()
+        client = order[launched]
+        launched += 1
+        pending.add(_hedge_executor.submit(_attempt_in_slot, client, extract_fn, args, default_search))
+        return True
+
+    launch(blocking=True)
+    while pending:
+        timeout = _hedge_delay(order[launched - 1]) if launched < len(order) else None
+        done, pending = concurrent.futures.wait(
+            pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        if not done:
+            if launch(blocking=False):
+                _bump_hedge_count("launched")
+                print(f"[YTDLP] Hedge: {timeout:.1f}s 무응답 → player_client={order[launched - 1]} 병렬 시작")
+            else:
+                # 동시 추출 상한이 찼으면 헤지하지 않고 지금 시도를 계속 기다린다(다음 지연 뒤 다시 확인)
+                _bump_hedge_count("skipped")
+            continue
+        for f in done:
+            if f.exception() is None:
+                # 아직 시작 안 한 시도는 취소(잡아 둔 자리 반납), 이미 도는 시도는 끝날 때까지
+                # 자리를 잡고 있다가 풀로 반납되고 결과는 버린다.
+                for p in pending:
+                    if p.cancel():
+                        _attempt_slots.release()
+                return f.result()
+            last_err = f.exception()
+        if launched < len(order):
+            # 남은 시도가 없으면 자리가 날 때까지 기다려서라도 다음 클라이언트로
+            launch(blocking=not pending)
+    raise last_err
+
 def _extract_with_clients(extract_fn, *args, default_search: Optional[str] = None):
     """
     extract_fn(ydl, *args)을 player_client 후보들을 바꿔가며 시도.
     하나라도 성공하면 반환, 모두 실패 시 마지막 예외를 올림.
+    시도 순서는 client_scores가 최근 성공률/지연으로 매번 다시 정하고,
+    YTDLP_HEDGE=1이면 순차 대신 헤지(병렬) 방식으로 시도한다.
+    YoutubeDL은 ydl_pool에서 빌려 쓰므로 실제 비용은 네트워크 왕복뿐이다.
     """
+    order = client_scores.order()
+    if YTDLP_HEDGE:
+        return _extract_hedged(order, extract_fn, args, default_search)
     last_err = None
-    for client in PLAYER_CLIENTS:
-        ydl_opts = _ydl_opts_base(default_search=default_search)
-        ea = dict(ydl_opts.get("extractor_args") or {})
-        ytargs = dict(ea.get("youtube") or {})
-        ytargs["player_client"] = client
-        ea["youtube"] = ytargs
-        ydl_opts["extractor_args"] = ea
-
-        # yt-dlp는 추출 종료 시 cookiefile에 쿠키를 다시 저장한다.
-        # 마운트된 원본이 읽기전용(:ro)이면 OSError로 성공한 추출까지 버려지고,
-        # 동시 추출이 같은 파일에 쓰면 손상될 수 있다. 매 시도마다 쓰기 가능한
-        # 임시 파일로 복사해 사용하고 끝나면 삭제한다(원본은 건드리지 않음).
-        tmp_cookie = None
-        src_cookie = ydl_opts.get("cookiefile")
-        if src_cookie:
-            fd, tmp_cookie = tempfile.mkstemp(prefix="ytcookies_", suffix=".txt")
-            os.close(fd)
-            shutil.copyfile(src_cookie, tmp_cookie)
-            ydl_opts["cookiefile"] = tmp_cookie
-
+    for i, client in enumerate(order):
+        if i > 0:
+            _count_extra_attempt()
+        _attempt_slots.acquire()
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                print(f"[YTDLP] Try player_client={client}")
-                return extract_fn(ydl, *args)
+            return _attempt_in_slot(client, extract_fn, args, default_search)
         except Exception as e:
             last_err = e
-            print(f"[YTDLP] player_client={client} failed: {e}")
-            continue
-        finally:
-            if tmp_cookie and os.path.exists(tmp_cookie):
-                os.remove(tmp_cookie)
     raise last_err
 
+def _counted_call(fn, *args):
+    """fn(*args) → (결과, 첫 시도 외에 추가로 나간 추출 수). 예외에는 extra_attempts를 달아 올린다.
+    limited_run이 추가 시도만큼 속도 제한 토큰을 더 차감하는 데 쓴다."""
+    _attempt_local.extra = 0
+    try:
+        result = fn(*args)
+    except Exception as e:
+        e.extra_attempts = _attempt_local.extra
+        raise
+    return result, _attempt_local.extra
+
 # =========================
 # yt-dlp Helper (동기 함수)
 # =========================
+def _compact_track(info: dict) -> dict:
+    """yt-dlp 추출 결과 → 봇이 쓰는 작은 track dict(스트림 URL/만료 포함)."""
+    url = info.get("url")
+    return {
+        "id": info.get("id"),
+        "webpage_url": info.get("webpage_url"),
+        "url": url,
+        "expire": stream_url_expiry(url),
+        "format_id": info.get("format_id"),
+        "acodec": info.get("acodec"),
+        "ext": info.get("ext"),
+        "title": info.get("title", "Unknown Title"),
+        "duration": info.get("duration"),
+        "thumbnail": info.get("thumbnail"),
+    }
+
+def _compact_flat_entry(entry: dict) -> dict:
+    """flat 검색 결과 항목 → 메타데이터만 있는 track dict(스트림 URL 없음)."""
+    video_id = entry.get("id")
+    thumbs = entry.get("thumbnails") or []
+    return {
+        "id": video_id,
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}" if video_id else entry.get("url"),
+        "title": entry.get("title", "Unknown Title"),
+        "duration": entry.get("duration"),
+        "thumbnail": entry.get("thumbnail") or (thumbs[-1].get("url") if thumbs else None),
+    }
+
 def _ytdlp_search_one_sync(query: str) -> dict:
     def _do(ydl, q):
         info = ydl.extract_info(q, download=False)
         if "entries" in info:
             info = info["entries"][0]
-        return {
-            "webpage_url": info.get("webpage_url"),
-            "url": info.get("url"),
-            "title": info.get("title", "Unknown Title"),
-            "duration": info.get("duration"),
-            "thumbnail": info.get("thumbnail"),
-        }
+        return _compact_track(info)
     return _extract_with_clients(_do, query, default_search="ytsearch")
 
+def _ytdlp_search_flat_sync(query: str, count: int) -> List[dict]:
+    """검색 상위 count개의 메타데이터만(flat). 검색 페이지 1회 왕복이라 player_client 폴백이 필요 없다."""
+    with ydl_pool.lease(PLAYER_CLIENTS[0], f"ytsearch{count}", flat=True) as ydl:
+        info = ydl.extract_info(query, download=False)
+    return [_compact_flat_entry(e) for e in list(info.get("entries") or [])[:count]]
+
+def _ytdlp_search_meta_sync(query: str) -> dict:
+    """검색 1위의 메타데이터만(flat)."""
+    entries = _ytdlp_search_flat_sync(query, 1)
+    if not entries:
+        raise LookupError(f"검색 결과 없음: {query}")
+    return entries[0]
+
+# 재생목록에서 삭제/비공개된 항목은 flat 결과에 이런 제목으로 남는다
+_UNAVAILABLE_PLAYLIST_TITLES = ("[Private video]", "[Deleted video]")
+
+def _ytdlp_playlist_page_sync(url: str, start: int, count: int) -> dict:
+    """재생목록의 start번째부터 count개 항목 메타데이터(flat). 스트림 URL은 해석하지 않는다.
+    반환: {"title": 재생목록 제목, "entries": [track...], "fetched": 이번에 받은 원본 항목 수}"""
+    with ydl_pool.lease(PLAYER_CLIENTS[0], flat=True) as ydl:
+        # 풀 인스턴스는 noplaylist=True(영상+list= URL은 영상 하나만)라 이 호출 동안만 바꿨다가 되돌린다
+        ydl.params["noplaylist"] = False
+        ydl.params["playlist_items"] = f"{start}-{start + count - 1}"
+        try:
+            info = ydl.extract_info(url, download=False)
+        finally:
+            ydl.params["noplaylist"] = True
+            ydl.params.pop("playlist_items", None)
+    raw = [e for e in (info.get("entries") or []) if e]
+    return {
+        "title": info.get("title"),
+        "entries": [_compact_flat_entry(e) for e in raw if e.get("title") not in _UNAVAILABLE_PLAYLIST_TITLES],
+        "fetched": len(raw),
+    }
+
+# 재생목록 커서: 한 재생목록의 항목 제너레이터를 페이지 사이에 계속 들고 있어, 다음 페이지가
+# 처음부터 다시 continuation을 훑지 않게 한다(비용이 오프셋이 아니라 페이지 크기에 비례).
+# 제너레이터는 만든 프로세스 안에서만 이어 쓸 수 있으므로 스레드 백엔드 전용.
+_playlist_cursors: Dict[str, dict] = {}
+# 열리기 전에(첫 페이지 추출 중 취소 등) 닫힌 커서 id → 닫은 시각. 늦게 열린 커서는 등록하지 않고 바로 닫는다.
+_closed_playlist_cursors: Dict[str, float] = {}
+_CLOSED_CURSOR_TTL = 3600.0
+_playlist_cursors_lock = threading.Lock()
+
+def _ytdlp_playlist_next_sync(cursor_id: str, url: str, count: int) -> dict:
+    """커서에서 다음 count개 항목(flat). 첫 호출에 커서를 연다. 반환 형식은 _ytdlp_playlist_page_sync와 같다."""
+    with _playlist_cursors_lock:
+        cursor = _playlist_cursors.get(cursor_id)
+        closed = cursor_id in _closed_playlist_cursors
+    if closed:
+        return {"title": None, "entries": [], "fetched": 0}
+    if cursor is None:
+        # 전용 인스턴스: 재생목록을 다 불러올 때까지 풀 인스턴스를 붙잡지 않도록
+        entry = _PooledYDL(PLAYER_CLIENTS[0], None, True)
+        entry.ydl.params["noplaylist"] = False
+        try:
+            info = entry.ydl.extract_info(url, download=False, process=False)
+            if info.get("_type") == "url":
+                # 탭 추출기가 다른 URL로 넘기는 경우 한 번 따라간다
+                info = entry.ydl.extract_info(info["url"], download=False, process=False, ie_key=info.get("ie_key"))
+        except Exception:
+            entry.close()
+            raise
+        cursor = {"entry": entry, "title": info.get("title"), "entries": iter(info.get("entries") or [])}
+        with _playlist_cursors_lock:
+            closed = _closed_playlist_cursors.pop(cursor_id, None) is not None
+            if not closed:
+                _playlist_cursors[cursor_id] = cursor
+        if closed:
+            entry.close()
+            return {"title": cursor["title"], "entries": [], "fetched": 0}
+    raw = [e for e in itertools.islice(cursor["entries"], count) if e]
+    return {
+        "title": cursor["title"],
+        "entries": [_compact_flat_entry(e) for e in raw if e.get("title") not in _UNAVAILABLE_PLAYLIST_TITLES],
+        "fetched": len(raw),
+    }
+
+def _ytdlp_playlist_close_sync(cursor_id: str):
+    """커서를 닫는다. 아직 열리는 중이면(추출 스레드가 첫 페이지를 받는 중) 열리자마자 닫히도록 표시."""
+    now = time.monotonic()
+    with _playlist_cursors_lock:
+        cursor = _playlist_cursors.pop(cursor_id, None)
+        if cursor is None:
+            for cid in [c for c, at in _closed_playlist_cursors.items() if now - at > _CLOSED_CURSOR_TTL]:
+                del _closed_playlist_cursors[cid]
+            _closed_playlist_cursors[cursor_id] = now
+    if cursor is not None:
+        cursor["entry"].close()
+
 def _ytdlp_from_url_sync(url: str) -> dict:
     def _do(ydl, u):
-        info = ydl.extract_info(u, download=False)
-        return {
-            "webpage_url": info.get("webpage_url"),
-            "url": info.get("url"),
-            "title": info.get("title", "Unknown Title"),
-            "duration": info.get("duration"),
-            "thumbnail": info.get("thumbnail"),
-        }
+        return _compact_track(ydl.extract_info(u, download=False))
     return _extract_with_clients(_do, url)
 
 def _ytdlp_search_top5_sync(query: str) -> List[dict]:
     def _do(ydl, q):
         info = ydl.extract_info(q, download=False)
         entries = info.get("entries", [])
-        return [{
-            "webpage_url": e.get("webpage_url"),
-            "url": e.get("url"),
-            "title": e.get("title", "Unknown Title"),
-            "duration": e.get("duration"),
-            "thumbnail": e.get("thumbnail"),
-        } for e in entries[:5]]
+        return [_compact_track(e) for e in entries[:5]]
     return _extract_with_clients(_do, query, default_search="ytsearch5")
 
 # =========================
-# yt-dlp Async Wrapper
+# 실패 캐시 (지역차단/로그인 필요 등 반복 실패를 빠르게 거절)
+# =========================
+def extract_video_id(url: str) -> Optional[str]:
+    """유튜브 URL에서 11자리 영상 ID를 뽑는다. 없으면 None."""
+    m = YOUTUBE_VIDEO_ID_REGEX.search(url)
+    return m.group(1) if m else None
+
+# =========================
+# 캐시 키 정규화 (모든 캐시가 같은 키를 쓰도록)
 # =========================
-async def get_track_info(query: str) -> dict:
-    """검색어/URL -> track dict. 캐시 사용. 비동기 래핑."""
-    if query in track_cache:
-        return track_cache[query]
+_WHITESPACE_REGEX = re.compile(r"\s+")
+
+def canonical_watch_url(video_id: str) -> str:
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+def normalize_search_text(text: str) -> str:
+    """검색어 정규화: 유니코드 NFKC + 대소문자 무시 + 공백 정리. ("Song" == "song ")"""
+    return _WHITESPACE_REGEX.sub(" ", unicodedata.normalize("NFKC", text)).strip().casefold()
+
+def canonical_key(query: str) -> str:
+    """검색어/URL → 캐시 키.
+
+    youtu.be/X, youtube.com/watch?v=X&t=30, www.youtube.com/watch?v=X&list=... 은 모두
+    "yt:X"가 되고, 검색어는 "q:<정규화된 검색어>"가 된다. 영상 ID가 없는 URL은 원문 그대로.
+    """
+    query = query.strip()
     if YOUTUBE_URL_REGEX.match(query):
-        info = await asyncio.to_thread(_ytdlp_from_url_sync, query)
+        video_id = extract_video_id(query)
+        return f"yt:{video_id}" if video_id else query
+    return f"q:{normalize_search_text(query)}"
+
+# (사유, 에러 메시지 패턴, TTL초). 위에서부터 먼저 맞는 규칙을 쓴다.
+# 봇 확인은 영상이 아니라 IP 단위 일시 차단이라 짧게, 영상 자체 문제는 길게 둔다.
+# 어느 규칙에도 안 맞는 실패(네트워크 오류 등)는 캐시하지 않는다.
+FAILURE_RULES = [
+    ("bot_check", re.compile(r"confirm you[’']re not a bot", re.IGNORECASE), 120),
+    ("region", re.compile(r"available in your country|blocked it in your country|geo.?restrict", re.IGNORECASE), 6 * 3600),
+    ("private", re.compile(r"private video|has been removed|no longer available|video unavailable|account associated with this video has been terminated", re.IGNORECASE), 6 * 3600),
+    ("login", re.compile(r"confirm your age|age.?restricted|inappropriate for some users|members.?only|join this channel|sign in", re.IGNORECASE), 3600),
+    ("no_formats", re.compile(r"requested format is not available|only images are available", re.IGNORECASE), 300),
+]
+
+def classify_failure(err: BaseException) -> Tuple[Optional[str], int]:
+    """추출 예외 → (실패 사유, 캐시 TTL초). 분류 불가면 (None, 0)."""
+    msg = str(err)
+    for reason, pattern, ttl in FAILURE_RULES:
+        if pattern.search(msg):
+            return reason, ttl
+    return None, 0
+
+class ExtractionBlocked(Exception):
+    """실패 캐시에 걸린 영상. 다시 추출하지 않고 바로 거절할 때 사용."""
+
+    def __init__(self, video_id: str, reason: str, message: str):
+        super().__init__(f"[negative-cache:{reason}] {video_id}: {message}")
+        self.video_id = video_id
+        self.reason = reason
+
+class NegativeCache:
+    """영상 ID → (실패 사유, 원본 메시지, 만료 시각). 스레드 안전."""
+
+    def __init__(self, maxsize: int = 2048):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[str, str, float]] = {}
+        self._maxsize = maxsize
+        self.hits = 0
+
+    def get(self, video_id: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None:
+                return None
+            reason, message, expires = entry
+            if time.monotonic() >= expires:
+                del self._entries[video_id]
+                return None
+            self.hits += 1
+            return reason, message
+
+    def put(self, video_id: str, err: BaseException) -> Optional[str]:
+        reason, ttl = classify_failure(err)
+        if reason is None or ttl <= 0:
+            return None
+        with self._lock:
+            if len(self._entries) >= self._maxsize:
+                # 가장 먼저 만료될 항목부터 밀어낸다
+                del self._entries[min(self._entries, key=lambda k: self._entries[k][2])]
+            self._entries[video_id] = (reason, str(err), time.monotonic() + ttl)
+        print(f"[NEGCACHE] {video_id} → {reason} ({ttl}s)")
+        return reason
+
+    def __len__(self):
+        return len(self._entries)
+
+negative_cache = NegativeCache()
+
+# =========================
+# 트랙 캐시 (크기 제한 LRU + 스트림 URL 만료 인식)
+# =========================
+# googlevideo 스트림 URL은 expire=<unix초> 파라미터(또는 /expire/<초>/ 경로) 시각에 죽는다.
+# 만료 STREAM_URL_MARGIN초 전부터는 캐시 미스로 취급해 새로 추출하게 한다.
+STREAM_URL_MARGIN = float(os.getenv("STREAM_URL_MARGIN", "600"))
+_EXPIRE_PATH_REGEX = re.compile(r"/expire/(\d+)")
+
+def stream_url_expiry(url: Optional[str]) -> Optional[float]:
+    """스트림 URL의 만료 시각(unix초). 알 수 없으면 None."""
+    if not url:
+        return None
+    values = parse_qs(urlsplit(url).query).get("expire")
+    if values and values[0].isdigit():
+        return float(values[0])
+    m = _EXPIRE_PATH_REGEX.search(url)
+    return float(m.group(1)) if m else None
+
+def stream_is_fresh(track: dict, margin: float = STREAM_URL_MARGIN) -> bool:
+    """스트림 URL이 없거나(메타데이터 전용) 만료까지 margin초 이상 남았으면 True."""
+    expire = track.get("expire")
+    return expire is None or expire - time.time() >= margin
+
+# 재생할 때마다 붙는 필드는 캐시에 넣지 않는다(다른 요청/길드와 공유되면 안 됨).
+_PER_PLAY_FIELDS = ("requester", "start_time")
+
+class TrackCache:
+    """키 → track dict LRU 캐시. 스트림 URL이 곧 만료되는 항목은 꺼낼 때 버린다.
+
+    꺼낸 dict는 사본이라 호출자가 requester 등을 붙여도 캐시 원본은 오염되지 않는다.
+    """
+
+    def __init__(self, maxsize: int = 256, margin: float = STREAM_URL_MARGIN):
+        self._data: "OrderedDict[str, dict]" = OrderedDict()
+        self._maxsize = maxsize
+        self._margin = margin
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def _is_stale(self, track: dict) -> bool:
+        return not stream_is_fresh(track, self._margin)
+
+    def get(self, key: str) -> Optional[dict]:
+        track = self._data.get(key)
+        if track is not None and self._is_stale(track):
+            del self._data[key]
+            self.expired += 1
+            track = None
+        if track is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return dict(track)
+
+    def put(self, key: str, track: dict):
+        entry = {k: v for k, v in track.items() if k not in _PER_PLAY_FIELDS}
+        if entry.get("url") and "expire" not in entry:
+            entry["expire"] = stream_url_expiry(entry["url"])
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = (self.hits / total * 100) if total else 0.0
+        return (f"{len(self)}/{self._maxsize}개, 적중 {self.hits} / 미스 {self.misses} ({ratio:.0f}%), "
+                f"LRU 제거 {self.evictions} / 만료 제거 {self.expired}")
+
+# 큐에 넣을 때 필요한 것은 오래 유효한 메타데이터뿐이고, 수명이 짧은 스트림 URL은
+# 재생 직전에 resolve_stream()이 따로 해석한다. 그래서 캐시도 둘로 나눈다.
+#   meta_cache  : 검색어/URL → 메타데이터(id/제목/길이/썸네일). 만료 없음.
+#   stream_cache: 영상 ID → 스트림 URL 포함 track. expire 기준으로 버림.
+META_FIELDS = ("id", "webpage_url", "title", "duration", "thumbnail")
+STREAM_FIELDS = ("url", "expire", "format_id", "acodec", "ext")
+meta_cache = TrackCache(maxsize=int(os.getenv("TRACK_CACHE_MAX", "256")))
+stream_cache = TrackCache(maxsize=int(os.getenv("STREAM_CACHE_MAX", "128")))
+
+# =========================
+# 영구 메타데이터 캐시 (SQLite, 재시작 후에도 유지)
+# =========================
+class PersistentMetaCache:
+    """검색어 → 영상 ID, 영상 ID → 메타데이터를 SQLite 파일에 보관한다.
+
+    - 첫 조회 때 DB를 연다(지연 로드) → 봇 기동 시간에 영향 없음.
+    - WAL 모드라 쓰기 중에도 읽기가 막히지 않는다.
+    - 쓰기는 메모리에 모았다가(write-behind) 백그라운드 스레드가 flush_interval초마다,
+      또는 batch_size개가 쌓이면 한 트랜잭션으로 기록한다.
+    - 영상 수가 max_rows를 넘으면 가장 오래 안 쓰인 것부터 지운다.
+    DB 오류가 나면 경고만 남기고 캐시를 끈다(봇 동작에는 지장 없음).
+    """
+
+    def __init__(self, path: str, max_rows: int = 20000, flush_interval: float = 5.0, batch_size: int = 50):
+        self.path = path
+        self._max_rows = max_rows
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._conn: Optional["sqlite3.Connection"] = None
+        self._db_lock = threading.Lock()       # 연결(읽기/쓰기) 보호
+        self._lock = threading.Lock()          # 대기 중인 쓰기 보호
+        self._pending_queries: Dict[str, str] = {}
+        self._pending_videos: Dict[str, dict] = {}
+        self._pending_touch: Dict[str, float] = {}
+        self._wake = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self.disabled = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connection(self) -> "sqlite3.Connection":
+        import sqlite3
+        if self._conn is None:
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS videos (id TEXT PRIMARY KEY, meta TEXT NOT NULL, last_used REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY KEY, video_id TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_last_used ON videos (last_used)")
+            # 검색어 키("q:")만 다시 읽으므로 예전에 저장된 URL 키 행은 정리(영상 행은 max_rows 정리로 빠진다)
+            conn.execute("DELETE FROM queries WHERE query NOT LIKE 'q:%'")
+            conn.commit()
+            self._conn = conn
+            print(f"[METADB] Opened {self.path}")
+        return self._conn
+
+    def _disable(self, err: Exception):
+        self.disabled = True
+        print(f"[METADB] 비활성화: {err}")
+
+    def get(self, query: str) -> Optional[dict]:
+        """검색어에 대응하는 메타데이터. 없으면 None. (블로킹 — 스레드에서 호출)"""
+        import sqlite3
+        if self.disabled:
+            return None
+        with self._lock:
+            video_id = self._pending_queries.get(query)
+            if video_id in self._pending_videos:
+                self.hits += 1
+                return dict(self._pending_videos[video_id])
+        try:
+            with self._db_lock:
+                row = self._connection().execute(
+                    "SELECT v.id, v.meta FROM queries q JOIN videos v ON v.id = q.video_id WHERE q.query = ?",
+                    (query,),
+                ).fetchone()
+        except sqlite3.Error as e:
+            self._disable(e)
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self._lock:
+            self._pending_touch[row[0]] = time.time()
+        return json.loads(row[1])
+
+    def put(self, query: str, meta: dict):
+        """메모리에 쌓아 두고 나중에 한꺼번에 기록(논블로킹)."""
+        video_id = meta.get("id")
+        if self.disabled or not video_id:
+            return
+        with self._lock:
+            self._pending_queries[query] = video_id
+            self._pending_videos[video_id] = dict(meta)
+            full = len(self._pending_videos) >= self._batch_size
+        self._ensure_writer()
+        if full:
+            self._wake.set()
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._writer_loop, name="metadb-writer", daemon=True)
+            self._writer.start()
+
+    def _writer_loop(self):
+        while not self.disabled:
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        import sqlite3
+        with self._lock:
+            queries, self._pending_queries = self._pending_queries, {}
+            videos, self._pending_videos = self._pending_videos, {}
+            touches, self._pending_touch = self._pending_touch, {}
+        if self.disabled or not (queries or videos or touches):
+            return
+        now = time.time()
+        try:
+            with self._db_lock:
+                conn = self._connection()
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO videos (id, meta, last_used) VALUES (?, ?, ?) "
+                        "ON CONFLICT(id) DO UPDATE SET meta = excluded.meta, last_used = excluded.last_used",
+                        [(vid, json.dumps(meta, ensure_ascii=False), now) for vid, meta in videos.items()],
+                    )
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO queries (query, video_id) VALUES (?, ?)",
+                        list(queries.items()),
+                    )
+                    conn.executemany(
+                        "UPDATE videos SET last_used = ? WHERE id = ?",
+                        [(ts, vid) for vid, ts in touches.items()],
+                    )
+                self._evict(conn)
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def _evict(self, conn: "sqlite3.Connection"):
+        (count,) = conn.execute("SELECT COUNT(*) FROM videos").fetchone()
+        if count <= self._max_rows:
+            return
+        # 한 번에 10% 여유를 두고 지워 매 flush마다 지우지 않게 한다
+        excess = count - int(self._max_rows * 0.9)
+        with conn:
+            conn.execute(
+                "DELETE FROM videos WHERE id IN (SELECT id FROM videos ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            conn.execute("DELETE FROM queries WHERE video_id NOT IN (SELECT id FROM videos)")
+        self.evictions += excess
+
+    def close(self):
+        self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> str:
+        if self.disabled:
+            return "비활성"
+        return f"적중 {self.hits} / 미스 {self.misses}, 제거 {self.evictions}"
+
+# 빈 값이면 영구 캐시를 쓰지 않는다. 조회/저장은 메인 프로세스에서만 하므로 워커는 열지 않는다.
+TRACK_DB_PATH = os.getenv("TRACK_DB_PATH", "track_cache.sqlite3")
+persistent_cache: Optional[PersistentMetaCache] = None
+if TRACK_DB_PATH and not IN_EXTRACT_WORKER:
+    persistent_cache = PersistentMetaCache(
+        TRACK_DB_PATH, max_rows=int(os.getenv("TRACK_DB_MAX_ROWS", "20000"))
+    )
+    atexit.register(persistent_cache.close)
+
+def track_meta(track: dict) -> dict:
+    return {k: track.get(k) for k in META_FIELDS}
+
+def track_video_id(track: dict) -> Optional[str]:
+    return track.get("id") or extract_video_id(track.get("webpage_url") or "")
+
+# =========================
+# yt-dlp 전용 실행기 (동시 실행 제한 + 대기열 지표)
+# =========================
+class ExtractionExecutor:
+    """yt-dlp 추출 전용 스레드 풀.
+
+    asyncio.to_thread의 기본 실행기를 다른 블로킹 작업과 나눠 쓰지 않도록 분리하고,
+    동시에 도는 추출 수를 max_workers로 제한한다(초과분은 세마포어 대기열에서 기다림).
+    대기열 길이/대기 시간/실행 시간을 기록해 인스턴스 크기 산정에 쓴다.
+    """
+
+    def __init__(self, max_workers: int, history: int = 200):
+        self.max_workers = max_workers
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ytdlp")
+        self._sem = asyncio.Semaphore(max_workers)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_waiting = 0
+        self._waits: deque = deque(maxlen=history)
+        self._runs: deque = deque(maxlen=history)
+
+    def _submit(self, fn, *args) -> concurrent.futures.Future:
+        return self._pool.submit(fn, *args)
+
+    async def run(self, fn, *args):
+        """fn(*args)를 실행기에서 돌리고 결과를 기다린다. 자리가 없으면 대기열에서 기다림."""
+        loop = asyncio.get_running_loop()
+        t_enqueue = time.monotonic()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        t_start = time.monotonic()
+        self._waits.append(t_start - t_enqueue)
+        self.running += 1
+
+        def _finished(f: concurrent.futures.Future):
+            # 기다리던 코루틴이 취소돼도 실제 작업이 끝날 때까지 자리를 잡고 있는다.
+            def _release():
+                self.running -= 1
+                self._runs.append(time.monotonic() - t_start)
+                if f.cancelled() or f.exception() is not None:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                self._sem.release()
+            loop.call_soon_threadsafe(_release)
+
+        try:
+            cfut = self._submit(fn, *args)
+        except BaseException:
+            self.running -= 1
+            self._sem.release()
+            raise
+        cfut.add_done_callback(_finished)
+        return await asyncio.wrap_future(cfut)
+
+    @staticmethod
+    def _quantile(values, q: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def stats(self) -> str:
+        return (
+            f"실행 {self.running}/{self.max_workers}, 대기 {self.waiting} (최대 {self.max_waiting}), "
+            f"완료 {self.completed} / 실패 {self.failed}\n"
+            f"대기 p50 {self._quantile(self._waits, 0.5):.2f}s · p90 {self._quantile(self._waits, 0.9):.2f}s, "
+            f"실행 p50 {self._quantile(self._runs, 0.5):.2f}s · p90 {self._quantile(self._runs, 0.9):.2f}s"
+        )
+
+class ExtractionError(Exception):
+    """프로세스 워커에서 난 추출 예외. yt-dlp 예외는 traceback 때문에 피클이 안 될 수 있어 메시지만 옮긴다."""
+
+def _process_job(pot_ok: bool, config_generation: int, fn, *args):
+    """프로세스 워커 안에서 fn(*args) 실행.
+    pot_ok/config_generation: 메인 프로세스의 POT 브레이커 판단과 설정 세대(다르면 워커도 설정을 다시 읽음)."""
+    global _pot_ok_override
+    if extraction_config.generation != config_generation:
+        reload_extraction_config("main process reload", generation=config_generation)
+    if _pot_ok_override != pot_ok:
+        # 첫 작업(None)이거나 모드가 바뀜 → 이전 옵션으로 만든 인스턴스는 버린다
+        if _pot_ok_override is not None:
+            ydl_pool.invalidate()
+        _pot_ok_override = pot_ok
+    try:
+        return fn(*args)
+    except Exception as e:
+        err = ExtractionError(str(e))
+        err.extra_attempts = getattr(e, "extra_attempts", 0)
+        raise err from None
+
+def _warm_process_worker():
+    """자주 쓰는 YoutubeDL 인스턴스(player_client별, flat 검색/재생목록용)를 미리 만들어 둔다(extractor/플러그인 로드).
+    프로세스 워커는 시작할 때, 스레드 백엔드는 on_ready 예열 때 실행."""
+    for client in PLAYER_CLIENTS:
+        with ydl_pool.lease(client):
+            pass
+    with ydl_pool.lease(PLAYER_CLIENTS[0], "ytsearch5", flat=True):
+        pass
+    with ydl_pool.lease(PLAYER_CLIENTS[0], flat=True):
+        pass
+
+def _init_process_worker(attempt_slots):
+    """프로세스 워커 시작: 동시 추출 상한을 워커 전체가 공유하는 세마포어로 바꾸고 예열."""
+    global _attempt_slots
+    _attempt_slots = attempt_slots
+    _warm_process_worker()
+
+class ProcessExtractionExecutor(ExtractionExecutor):
+    """추출을 별도 프로세스 풀에서 실행하는 백엔드.
+
+    yt-dlp의 JSON/정규식 처리가 봇 프로세스의 GIL을 잡아 음성 송출 스레드가 끊기는 것을 막는다.
+    워커는 시작할 때 예열하고, max_jobs건을 처리하면 새 프로세스로 교체(메모리 누수 방지).
+    워커 안의 YoutubeDL 풀/client 점수는 프로세스마다 따로 쌓인다.
+    워커가 죽어(OOM 등) 풀이 깨지면 다음 작업을 넣을 때 풀을 새로 만든다.
+    """
+
+    def __init__(self, max_workers: int, max_jobs: int = 50, history: int = 200):
+        super().__init__(max_workers, history)
+        self._pool.shutdown(wait=False)
+        self.max_jobs = max_jobs
+        self.restarts = 0
+        self._pool = self._new_pool()
+
+    def _new_pool(self) -> "concurrent.futures.ProcessPoolExecutor":
+        # max_tasks_per_child는 fork와 함께 쓸 수 없어 spawn 사용 (워커는 이 파일을 __mp_main__으로 import)
+        # 동시 추출 세마포어도 풀마다 새로 만든다(죽은 워커가 잡고 있던 자리는 돌아오지 않으므로).
+        import multiprocessing
+        ctx = multiprocessing.get_context("spawn")
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=ctx,
+            initializer=_init_process_worker,
+            initargs=(ctx.BoundedSemaphore(self.max_workers),),
+            max_tasks_per_child=self.max_jobs,
+        )
+
+    def _submit(self, fn, *args) -> concurrent.futures.Future:
+        job = (_process_job, pot_available(), extraction_config.generation, fn, *args)
+        try:
+            return self._pool.submit(*job)
+        except concurrent.futures.BrokenExecutor:
+            print("[EXTRACT] 프로세스 풀이 깨짐(워커 비정상 종료) → 새 풀로 교체")
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+            self.restarts += 1
+            return self._pool.submit(*job)
+
+    def stats(self) -> str:
+        text = super().stats()
+        if self.restarts:
+            text += f"\n풀 재생성 {self.restarts}회"
+        return text
+
+# EXTRACT_BACKEND=thread(기본) | process
+EXTRACT_BACKEND = os.getenv("EXTRACT_BACKEND", "thread")
+if EXTRACT_BACKEND == "process" and not IN_EXTRACT_WORKER:
+    extractor: ExtractionExecutor = ProcessExtractionExecutor(
+        max_workers=int(os.getenv("EXTRACT_WORKERS", "4")),
+        max_jobs=int(os.getenv("EXTRACT_PROCESS_MAX_JOBS", "50")),
+    )
+else:
+    extractor = ExtractionExecutor(max_workers=int(os.getenv("EXTRACT_WORKERS", "4")))
+
+# =========================
+# 동일 요청 합치기 (single-flight)
+# =========================
+class SingleFlight:
+    """같은 키로 동시에 들어온 비동기 조회를 하나의 작업으로 합친다.
+
+    먼저 온 호출이 작업(Task)을 만들고, 끝나기 전에 같은 키로 온 호출은 그 결과를 같이 기다린다.
+    작업은 별도 Task라 기다리던 호출 하나가 취소돼도 나머지에게는 영향이 없다.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, coro_factory):
+        task = self._inflight.get(key)
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(coro_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+            print(f"[FLIGHT:{self.name}] 진행 중인 조회에 합류: {key}")
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 기다리던 쪽이 모두 취소된 경우에도 'exception was never retrieved' 경고가 나지 않게
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> str:
+        return f"시작 {self.started} / 합류 {self.coalesced} / 진행 중 {len(self._inflight)}"
+
+track_flights = SingleFlight("track")
+url_flights = SingleFlight("url")
+
+# =========================
+# 추출 속도 제한 (전역 + 길드별 토큰 버킷)
+# =========================
+class TokenBucket:
+    """초당 rate개씩 채워지고 최대 burst개까지 쌓이는 토큰 버킷."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self._stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+
+    def wait_time(self, now: float) -> float:
+        """토큰 하나가 생길 때까지 남은 초(지금 있으면 0)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, n: float = 1):
+        self.tokens -= n
+
+    def time_until(self, now: float, tokens: float) -> float:
+        """토큰이 tokens개(최대 burst)가 될 때까지 남은 초."""
+        self._refill(now)
+        target = min(tokens, self.burst)
+        if self.tokens >= target:
+            return 0.0
+        return (target - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+class ExtractionRateLimiter:
+    """유튜브로 나가는 추출 요청의 속도 제한.
+
+    모든 추출이 같은 IP에서 나가므로 전역 버킷으로 전체 속도를 묶고, 길드별 버킷으로 한 길드가
+    전역 예산을 독차지하지 못하게 한다. 토큰이 없으면 실패시키지 않고 대기열에 넣으며,
+    대기열은 길드 단위 라운드 로빈으로 처리한다(길드마다 한 건씩 번갈아).
+    """
+
+    def __init__(self, global_per_min: float, global_burst: int, guild_per_min: float, guild_burst: int,
+                 history: int = 200):
+        self.enabled = global_per_min > 0
+        self._global = TokenBucket(global_per_min / 60.0, global_burst)
+        self._guild_rate = guild_per_min / 60.0
+        self._guild_burst = guild_burst
+        self._buckets: Dict[Optional[int], TokenBucket] = {}
+        self._queues: "OrderedDict[Optional[int], deque]" = OrderedDict()
+        self._wake = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.granted = 0
+        self.delayed = 0
+        self.max_waiting = 0
+        self.extra_charged = 0
+        self._waits: deque = deque(maxlen=history)
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _bucket(self, guild_id: Optional[int]) -> TokenBucket:
+        bucket = self._buckets.get(guild_id)
+        if bucket is None:
+            if len(self._buckets) >= 256:
+                # 가득 찬(한동안 안 쓴) 버킷은 새로 만든 것과 같으므로 버린다
+                now = time.monotonic()
+                for gid in [g for g, b in self._buckets.items() if g not in self._queues and b.is_full(now)]:
+                    del self._buckets[gid]
+            if self._guild_rate > 0:
+                bucket = TokenBucket(self._guild_rate, self._guild_burst)
+            else:
+                bucket = TokenBucket(float("inf"), 1)
+            self._buckets[guild_id] = bucket
+        return bucket
+
+    def position(self, guild_id: Optional[int], fut: asyncio.Future) -> int:
+        """라운드 로빈 순서로 본 대략적인 대기 순번(1부터)."""
+        queue = self._queues.get(guild_id)
+        if not queue or fut not in queue:
+            return 1
+        i = queue.index(fut)
+        ahead = 0
+        before = True
+        for gid, q in self._queues.items():
+            if gid == guild_id:
+                ahead += i
+                before = False
+            else:
+                ahead += min(len(q), i) + (1 if before and len(q) > i else 0)
+        return ahead + 1
+
+    async def acquire(self, guild_id: Optional[int], on_wait=None):
+        """추출 한 건을 보낼 수 있을 때까지 기다린다.
+        on_wait: 기다려야 할 때 대기 순번(int)으로 호출되는 코루틴 함수(순번이 바뀔 때마다)."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        bucket = self._bucket(guild_id)
+        if not self._queues and self._global.wait_time(now) == 0 and bucket.wait_time(now) == 0:
+            self._global.take()
+            bucket.take()
+            self.granted += 1
+            self._waits.append(0.0)
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(guild_id, deque()).append(fut)
+        self.delayed += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        self._kick()
+        last_pos = None
+        try:
+            while not fut.done():
+                pos = self.position(guild_id, fut)
+                if on_wait is not None and pos != last_pos:
+                    last_pos = pos
+                    try:
+                        await on_wait(pos)
+                    except Exception as e:
+                        print(f"[RATE] 대기 안내 실패: {e}")
+                try:
+                    await asyncio.wait_for(asyncio.shield(fut), timeout=2.0)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            fut.cancel()
+            self._discard(guild_id, fut)
+            raise
+        self._waits.append(time.monotonic() - now)
+
+    def spare_in(self, guild_id: Optional[int], reserve: int) -> float:
+        """전역/길드 버킷에 reserve개를 남기고도 한 건을 더 쓸 수 있을 때까지 남은 초(지금 되면 0).
+        백그라운드 해석이 사용자 명령 몫을 쓰지 않게 할 때 쓴다. 대기 중인 요청이 있으면 양보."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._bucket(guild_id)
+        wait = max(
+            self._global.time_until(now, min(reserve, self._global.burst - 1) + 1),
+            bucket.time_until(now, min(reserve, bucket.burst - 1) + 1),
+        )
+        if wait == 0 and self._queues:
+            return 1.0
+        return wait
+
+    def charge(self, n: int):
+        """이미 나간 추가 추출 n건(player_client 재시도/헤지)을 사후에 전역 버킷에서만 차감한다.
+        토큰이 음수가 될 수 있고, 그만큼 다음 요청이 더 기다린다. 길드 버킷은 명령 한 건당 하나만 쓰므로
+        폴백 체인을 길게 탄 길드의 다음 명령이 그 때문에 밀리지는 않는다."""
+        if not self.enabled or n <= 0:
+            return
+        self._global.wait_time(time.monotonic())
+        self._global.take(n)
+        self.extra_charged += n
+
+    def _discard(self, guild_id: Optional[int], fut: asyncio.Future):
+        queue = self._queues.get(guild_id)
+        if queue is not None and fut in queue:
+            queue.remove(fut)
+            if not queue:
+                del self._queues[guild_id]
+
+    def _kick(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        self._wake.set()
+
+    def _serve_once(self, now: float) -> Optional[float]:
+        """대기 중인 요청 하나에 토큰을 준다. 줬으면 0, 못 줬으면 기다릴 초, 대기열이 비었으면 None."""
+        global_wait = self._global.wait_time(now)
+        best: Optional[float] = None
+        for gid in list(self._queues):
+            queue = self._queues[gid]
+            while queue and queue[0].done():
+                queue.popleft()
+            if not queue:
+                del self._queues[gid]
+                continue
+            wait = max(global_wait, self._bucket(gid).wait_time(now))
+            if wait == 0:
+                self._global.take()
+                self._buckets[gid].take()
+                queue.popleft().set_result(None)
+                self.granted += 1
+                if queue:
+                    self._queues.move_to_end(gid)
+                else:
+                    del self._queues[gid]
+                return 0.0
+            best = wait if best is None else min(best, wait)
+        return best
+
+    async def _dispatch(self):
+        while True:
+            wait = self._serve_once(time.monotonic())
+            if wait is None:
+                return
+            if wait > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stats(self) -> str:
+        if not self.enabled:
+            return "비활성"
+        now = time.monotonic()
+        self._global.wait_time(now)
+        short = sum(1 for b in self._buckets.values() if b.wait_time(now) > 0)
+        q = ExtractionExecutor._quantile
+        return (
+            f"전역 토큰 {self._global.tokens:.1f}/{self._global.burst}, "
+            f"길드 버킷 {len(self._buckets)}개 (소진 {short}개)\n"
+            f"대기 {self.waiting} (최대 {self.max_waiting}), 통과 {self.granted} / 그중 대기 후 {self.delayed}, "
+            f"추가 시도 차감 {self.extra_charged}, 대기 p50 {q(self._waits, 0.5):.2f}s · p90 {q(self._waits, 0.9):.2f}s"
+        )
+
+# RATE_GLOBAL_PER_MIN=0이면 제한하지 않는다
+rate_limiter = ExtractionRateLimiter(
+    global_per_min=float(os.getenv("RATE_GLOBAL_PER_MIN", "30")),
+    global_burst=int(os.getenv("RATE_GLOBAL_BURST", "10")),
+    guild_per_min=float(os.getenv("RATE_GUILD_PER_MIN", "12")),
+    guild_burst=int(os.getenv("RATE_GUILD_BURST", "4")),
+)
+
+async def limited_run(guild_id: Optional[int], fn, *args, on_wait=None):
+    """속도 제한 토큰을 받은 뒤 fn(*args)를 추출 실행기에서 돌린다. 유튜브로 나가는 추출은 모두 여기를 거친다.
+    토큰은 요청당 하나를 먼저 받고, player_client 재시도/헤지로 더 나간 추출은 끝난 뒤 전역 버킷에서만 차감한다."""
+    await rate_limiter.acquire(guild_id, on_wait)
+    try:
+        result, extra = await extractor.run(_counted_call, fn, *args)
+    except Exception as e:
+        rate_limiter.charge(getattr(e, "extra_attempts", 0))
+        raise
+    rate_limiter.charge(extra)
+    return result
+
+# =========================
+# yt-dlp Async Wrapper
+# =========================
+async def extract_url(url: str, guild_id: Optional[int] = None, on_wait=None) -> dict:
+    """URL → track dict. 실패 캐시에 있으면 추출 없이 ExtractionBlocked, 실패하면 분류해 기록.
+    영상 URL은 t=/list= 등을 뗀 표준 watch URL로 바꿔 추출한다.
+    guild_id/on_wait: 속도 제한에서 요청을 세는 길드와 대기 안내 콜백(limited_run 참고)."""
+    video_id = extract_video_id(url)
+    if video_id:
+        cached = negative_cache.get(video_id)
+        if cached:
+            raise ExtractionBlocked(video_id, *cached)
+        url = canonical_watch_url(video_id)
+
+    async def _extract():
+        try:
+            info = await limited_run(guild_id, _ytdlp_from_url_sync, url, on_wait=on_wait)
+        except Exception as e:
+            if video_id:
+                negative_cache.put(video_id, e)
+            raise
+        # 추출은 비싸므로 결과(스트림 URL/메타데이터)는 어느 경로에서 얻었든 공유 캐시에 남긴다
+        _remember_stream(info)
+        if info.get("id"):
+            remember_meta(f"yt:{info['id']}", track_meta(info))
+        return info
+
+    # 여러 길드/사용자가 같은 영상을 동시에 요청해도 추출은 한 번만
+    return dict(await url_flights.run(video_id or url, _extract))
+
+def _remember_stream(info: dict):
+    """추출 결과의 스트림 URL을 stream_cache에 넣어 재생 시 재추출을 피한다."""
+    video_id = track_video_id(info)
+    if video_id and info.get("url"):
+        stream_cache.put(video_id, info)
+
+def remember_meta(key: str, meta: dict):
+    """메타데이터를 key와 영상 키("yt:<ID>") 양쪽으로 메모리 캐시에 저장 → 검색 후 같은 영상 URL도 적중.
+    영구 캐시에는 검색어 키("q:")만 쓴다. URL 조회는 매번 검증(_validated_url_info)하느라 영구 캐시를 읽지 않는다."""
+    keys = {key}
+    if meta.get("id"):
+        keys.add(f"yt:{meta['id']}")
+    for k in keys:
+        meta_cache.put(k, meta)
+        if persistent_cache is not None and k.startswith("q:"):
+            persistent_cache.put(k, meta)
+
+async def get_track_info(query: str, resolve: bool = False, guild_id: Optional[int] = None, on_wait=None) -> dict:
+    """검색어/URL -> 큐에 넣을 메타데이터 track dict(사본).
+
+    - URL: 재생 가능 여부 확인(차단 시 검색 폴백)을 위해 전체 추출하고, 얻은 스트림 URL은
+      stream_cache에 넣어 둔다. 캐시된 메타데이터는 신선한 스트림이 있을 때(=최근에 검증됨)만 쓴다.
+    - 검색어: resolve=False면 flat 검색으로 메타데이터만(싸다). 바로 재생할 곡이면
+      resolve=True로 검색과 스트림 해석을 한 번에 한다.
+    """
+    key = canonical_key(query)
+    if YOUTUBE_URL_REGEX.match(query.strip()):
+        return await _validated_url_info(key, query, guild_id, on_wait)
+    cached = meta_cache.get(key)
+    if cached is not None:
+        return cached
+    # 같은 키의 동시 조회(인기곡 동시 !p 등)는 한 번의 조회 결과를 나눠 쓴다
+    meta = await track_flights.run(key, lambda: _load_track_info(key, query, resolve, guild_id, on_wait))
+    return dict(meta)
+
+async def _validated_url_info(key: str, query: str, guild_id: Optional[int], on_wait) -> dict:
+    """URL 조회. 메타데이터 캐시만 보고 큐에 넣으면 그 사이 막히거나 지워진 영상도 들어가므로,
+    실패 캐시를 먼저 보고, stream_cache에 신선한 스트림이 있을 때만 캐시된 메타데이터를 쓴다.
+    그 밖에는 추출로 검증(실패하면 예외 → !p의 검색 폴백)."""
+    video_id = key[3:] if key.startswith("yt:") else None
+    if video_id:
+        blocked = negative_cache.get(video_id)
+        if blocked:
+            raise ExtractionBlocked(video_id, *blocked)
+        cached = meta_cache.get(key)
+        stream = stream_cache.get(video_id)
+        if cached is not None and stream is not None and stream_is_fresh(stream):
+            return cached
+    info = await extract_url(query, guild_id, on_wait)
+    meta = track_meta(info)
+    remember_meta(key, meta)
+    return dict(meta)
+
+async def _load_track_info(key: str, query: str, resolve: bool, guild_id: Optional[int], on_wait) -> dict:
+    """검색어가 메모리 캐시에 없을 때: 영구 캐시 → yt-dlp 순으로 조회하고 결과를 캐시에 저장."""
+    if persistent_cache is not None:
+        stored = await asyncio.to_thread(persistent_cache.get, key)
+        if stored is not None:
+            meta_cache.put(key, stored)
+            return stored
+    if resolve:
+        info = await limited_run(guild_id, _ytdlp_search_one_sync, query, on_wait=on_wait)
+        _remember_stream(info)
     else:
-        info = await asyncio.to_thread(_ytdlp_search_one_sync, query)
-    track_cache[query] = info
-    return info
+        info = await limited_run(guild_id, _ytdlp_search_meta_sync, query, on_wait=on_wait)
+    meta = track_meta(info)
+    remember_meta(key, meta)
+    return meta
+
+async def resolve_stream(track: dict, margin: float = STREAM_URL_MARGIN, guild_id: Optional[int] = None) -> dict:
+    """재생 직전에 track의 스트림 URL을 채운다(신선하면 그대로, 아니면 캐시/재추출).
+    margin: 만료까지 최소 이만큼(초) 남은 URL만 신선한 것으로 본다."""
+    if track.get("url") and stream_is_fresh(track, margin):
+        return track
+    video_id = track_video_id(track)
+    info = stream_cache.get(video_id) if video_id else None
+    if info is None or not stream_is_fresh(info, margin):
+        info = await extract_url(track["webpage_url"], guild_id)
+    for field in STREAM_FIELDS:
+        track[field] = info.get(field)
+    return track
+
+# !search는 다섯 곡 중 많아야 하나를 고르므로, 기본은 flat 검색(메타데이터만)으로 한 번에 받고
+# 고른 곡의 스트림 URL은 반응(리액션) 시점에 해석한다. SEARCH_FLAT=0이면 예전처럼 다섯 곡 모두 전체 추출.
+SEARCH_FLAT = os.getenv("SEARCH_FLAT", "1") == "1"
+
+async def search_top5(query: str, guild_id: Optional[int] = None, on_wait=None) -> List[dict]:
+    if SEARCH_FLAT:
+        return await limited_run(guild_id, _ytdlp_search_flat_sync, query, 5, on_wait=on_wait)
+    return await limited_run(guild_id, _ytdlp_search_top5_sync, query, on_wait=on_wait)
 
-async def search_top5(query: str) -> List[dict]:
-    return await asyncio.to_thread(_ytdlp_search_top5_sync, query)
+# =========================
+# 재생목록 (flat으로 페이지 단위 지연 로드)
+# =========================
+PLAYLIST_MAX = int(os.getenv("PLAYLIST_MAX", "300"))         # 한 재생목록에서 가져올 최대 곡 수
+PLAYLIST_PAGE = int(os.getenv("PLAYLIST_PAGE", "50"))        # 한 번에 가져올 항목 수
+PLAYLIST_FIRST_PAGE = 10                                     # 첫 곡을 빨리 틀기 위해 첫 페이지는 작게
+PLAYLIST_LOW_WATER = int(os.getenv("PLAYLIST_LOW_WATER", "10"))  # 대기열이 이보다 줄면 다음 페이지 로드
+
+def is_playlist_url(query: str) -> bool:
+    """영상 ID 없이 list=만 있는 유튜브 재생목록 URL인지. (watch?v=X&list=... 는 영상 하나로 취급)"""
+    query = query.strip()
+    if not YOUTUBE_URL_REGEX.match(query) or extract_video_id(query):
+        return False
+    if "://" not in query:
+        query = "https://" + query
+    return bool(parse_qs(urlsplit(query).query).get("list"))
+
+async def iter_playlist(url: str, limit: int = PLAYLIST_MAX, guild_id: Optional[int] = None, on_wait=None):
+    """재생목록을 페이지 단위로 가져오는 비동기 제너레이터. 소비하는 쪽이 다음 페이지를 요청할 때만 추출.
+    스레드 백엔드는 커서(_ytdlp_playlist_next_sync)로 이어 읽고, 프로세스 백엔드는 페이지마다
+    playlist_items로 다시 추출한다(워커가 매번 다를 수 있어 제너레이터를 이어 쓸 수 없음)."""
+    cursor_id = None
+    try:
+        # 취소(!stop 등)가 첫 페이지 추출 중에 와도 finally에서 커서가 닫히도록 제너레이터 전체를 감싼다
+        if EXTRACT_BACKEND != "process":
+            cursor_id = f"{id(object())}:{time.monotonic()}"
+        start = 1
+        count = min(PLAYLIST_FIRST_PAGE, limit)
+        while start <= limit and count > 0:
+            if cursor_id is not None:
+                page = await limited_run(guild_id, _ytdlp_playlist_next_sync, cursor_id, url, count, on_wait=on_wait)
+            else:
+                page = await limited_run(guild_id, _ytdlp_playlist_page_sync, url, start, count, on_wait=on_wait)
+            yield page
+            if page["fetched"] < count:
+                return
+            start += count
+            count = min(PLAYLIST_PAGE, limit - start + 1)
+    finally:
+        if cursor_id is not None:
+            await asyncio.to_thread(_ytdlp_playlist_close_sync, cursor_id)
+
+# 검색 폴백에서 후보를 동시에 검증할 최대 개수
+FALLBACK_PARALLEL = int(os.getenv("FALLBACK_PARALLEL", "3"))
+
+async def first_playable(candidates: List[dict], parallel: int = FALLBACK_PARALLEL,
+                         guild_id: Optional[int] = None) -> Optional[Tuple[dict, dict]]:
+    """후보들을 최대 parallel개씩 동시에 추출해 보고, 재생 가능한 후보 중 순위가 가장 높은
+    (후보, 추출 결과)를 반환. 윗순위 후보의 결과가 모두 나오는 즉시 확정하고 나머지는 취소/무시."""
+    sem = asyncio.Semaphore(parallel)
+
+    async def _check(c: dict) -> dict:
+        async with sem:
+            return await extract_url(c["webpage_url"], guild_id)
+
+    tasks = [asyncio.ensure_future(_check(c)) for c in candidates]
+    try:
+        for c, task in zip(candidates, tasks):
+            try:
+                return c, await task
+            except Exception as e:
+                print(f"[yt-dlp candidate fail] {c.get('title')} | {e}")
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
 
 # =========================
 # 반복(loop) 모드
@@ -230,10 +2272,9 @@ def track_thumbnail(track: dict) -> Optional[str]:
     thumb = track.get("thumbnail")
     if thumb:
         return thumb
-    url = track.get("webpage_url") or ""
-    m = re.search(r"(?:v=|youtu\.be/|/shorts/|/embed/)([0-9A-Za-z_-]{11})", url)
-    if m:
-        return f"https://i.ytimg.com/vi/{m.group(1)}/hqdefault.jpg"
+    video_id = extract_video_id(track.get("webpage_url") or "")
+    if video_id:
+        return f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
     return None
 
 def build_now_playing_embed(track: dict, player: "GuildMusicPlayer") -> discord.Embed:
@@ -284,6 +2325,18 @@ def build_added_embed(track: dict, position: int) -> discord.Embed:
 # =========================
 # Guild 음악 상태 관리
 # =========================
+# 다음 곡(프리페치) 외에 대기열 앞쪽 몇 곡을 재생 중에 미리 해석해 둘지. 0이면 끔.
+PREFETCH_WINDOW = int(os.getenv("PREFETCH_WINDOW", "3"))
+# 스트림 URL이 (STREAM_URL_MARGIN + 이 값)초 안에 만료되면 미리 새로 해석
+WINDOW_REFRESH_LEAD = float(os.getenv("PREFETCH_REFRESH_LEAD", "900"))
+WINDOW_POLL = 300.0          # 할 일이 없을 때 최대 대기(초)
+WINDOW_GAP = 0.5             # 연속 해석 사이 간격(초)
+WINDOW_RETRY_AFTER = 300.0   # 해석 실패한 곡은 이 시간 동안 다시 시도하지 않음
+# 모든 길드를 통틀어 동시에 도는 대기열 창 해석 수(사용자 요청보다 낮은 우선순위)
+_window_sem = asyncio.Semaphore(max(1, int(os.getenv("EXTRACT_WORKERS", "4")) // 2))
+# 대기열 창 해석은 속도 제한 버킷(전역/길드)에 이만큼 토큰이 남아 있을 때만 한다(사용자 명령 몫).
+WINDOW_RATE_RESERVE = int(os.getenv("PREFETCH_RATE_RESERVE", "2"))
+
 class GuildMusicPlayer:
     def __init__(self, guild_id: int):
         self.guild_id = guild_id
@@ -294,13 +2347,35 @@ class GuildMusicPlayer:
         self.current: Optional[dict] = None  # 현재 재생 중인 트랙
         self.skip_requested: bool = False    # 스킵 시 한 곡 반복을 무시하기 위한 플래그
         self.text_channel = None             # 자동 다음곡 안내를 보낼 텍스트 채널
+        self._shuffle_pick: Optional[dict] = None          # 랜덤 반복에서 미리 정해 둔 다음 곡
+        self._prefetch_task: Optional[asyncio.Task] = None  # 다음 곡 스트림 미리 해석
+        self._window_task: Optional[asyncio.Task] = None    # 대기열 창(window) 미리 해석/갱신
+        self._window_wake = asyncio.Event()
+        self.session: int = 0                # 음성 연결이 끊길 때마다 증가(reset_session) → 재생목록 불러오기 중단용
 
     def add_to_queue(self, track: dict):
         self.queue.append(track)
+        self.queue_changed()
+
+    def reset_session(self):
+        """음성 연결이 끊겼을 때(!나가기/자동 퇴장/강제 퇴장): 큐를 비우고 세션을 올려
+        진행 중인 재생목록 불러오기 등을 멈춘다."""
+        self.queue.clear()
+        self.playing = False
+        self.current = None
+        self.skip_requested = False
+        self.session += 1
+        self.queue_changed()
+
+    def extend_queue(self, tracks: List[dict]):
+        self.queue.extend(tracks)
+        self.queue_changed()
 
     def remove_from_queue_index(self, idx: int) -> Optional[dict]:
         if 0 <= idx < len(self.queue):
-            return self.queue.pop(idx)
+            removed = self.queue.pop(idx)
+            self.queue_changed()
+            return removed
         return None
 
     def has_next_track(self) -> bool:
@@ -328,9 +2403,112 @@ class GuildMusicPlayer:
         if mode in (LOOP_ALL, LOOP_SHUFFLE) and finished is not None:
             self.queue.append(finished)
         if mode == LOOP_SHUFFLE:
+            # 미리 골라(프리페치해) 둔 곡이 아직 큐에 있으면 그 곡으로
+            pick, self._shuffle_pick = self._shuffle_pick, None
+            for i, t in enumerate(self.queue):
+                if t is pick:
+                    return self.queue.pop(i)
             return self.pop_random_track()
         return self.pop_next_track()
 
+    def peek_next(self, finished: Optional[dict]) -> Optional[dict]:
+        """pick_next(finished)가 고를 곡을 큐를 바꾸지 않고 예측. 랜덤 반복은 여기서 미리 뽑아 둔다."""
+        mode = self.loop_mode
+        if mode == LOOP_ONE:
+            return finished
+        if mode == LOOP_SHUFFLE:
+            pool = self.queue + ([finished] if finished is not None else [])
+            self._shuffle_pick = random.choice(pool) if pool else None
+            return self._shuffle_pick
+        if self.queue:
+            return self.queue[0]
+        return finished if mode == LOOP_ALL else None
+
+    def queue_changed(self):
+        """큐/반복 모드가 바뀌면 다음 곡 예측이 달라지므로 프리페치를 다시 걸고, 대기열 창도 다시 살핀다."""
+        self.schedule_prefetch()
+        self._window_wake.set()
+
+    def schedule_prefetch(self):
+        """현재 곡이 재생되는 동안 다음에 재생될 곡의 스트림 URL을 미리 해석해 둔다."""
+        if self._prefetch_task is not None and not self._prefetch_task.done():
+            self._prefetch_task.cancel()
+        self._prefetch_task = None
+        if not self.playing or self.current is None:
+            self._shuffle_pick = None
+            return
+        target = self.peek_next(self.current)
+        if target is None or (target.get("url") and stream_is_fresh(target)):
+            return
+        self._prefetch_task = asyncio.ensure_future(self._prefetch(target))
+
+    async def _prefetch(self, track: dict):
+        try:
+            await resolve_stream(track, guild_id=self.guild_id)
+            print(f"[PREFETCH] guild={self.guild_id} 다음 곡 준비 완료: {track.get('title')}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 실패해도 재생 시점에 다시 해석/건너뜀 처리되므로 기록만
+            print(f"[PREFETCH] guild={self.guild_id} 다음 곡 해석 실패: {track.get('title')} | {e}")
+
+    def ensure_window_refresher(self):
+        """대기열 앞쪽 PREFETCH_WINDOW곡을 백그라운드에서 미리 해석/갱신하는 작업을 (없으면) 시작."""
+        if PREFETCH_WINDOW <= 0:
+            return
+        if self._window_task is None or self._window_task.done():
+            self._window_task = asyncio.ensure_future(self._window_loop())
+        self._window_wake.set()
+
+    def _window_target(self) -> Tuple[Optional[dict], float]:
+        """(지금 해석할 곡, 없으면 다음에 깨어날 때까지 초)."""
+        now = time.time()
+        refresh_margin = STREAM_URL_MARGIN + WINDOW_REFRESH_LEAD
+        sleep_for = WINDOW_POLL
+        for track in self.queue[:PREFETCH_WINDOW]:
+            failed_at = track.get("resolve_failed_at")
+            if failed_at and now - failed_at < WINDOW_RETRY_AFTER:
+                continue
+            if not track.get("url"):
+                return track, 0.0
+            expire = track.get("expire")
+            if expire is None:
+                continue
+            due_in = expire - refresh_margin - now
+            if due_in <= 0:
+                return track, 0.0
+            sleep_for = min(sleep_for, due_in)
+        return None, sleep_for
+
+    async def _window_loop(self):
+        """재생 중인 동안 대기열 창(window)의 스트림 URL을 낮은 우선순위로 채우고, 만료 전에 갱신."""
+        while self.playing:
+            track, sleep_for = self._window_target()
+            if track is None:
+                self._window_wake.clear()
+                try:
+                    await asyncio.wait_for(self._window_wake.wait(), timeout=max(sleep_for, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # 낮은 우선순위: 사용자 요청이 실행기/속도 제한 대기열에 있거나
+            # 버킷에 사용자 명령 몫(WINDOW_RATE_RESERVE)만 남았으면 채워질 때까지 양보
+            if extractor.waiting > 0:
+                await asyncio.sleep(1.0)
+                continue
+            spare_in = rate_limiter.spare_in(self.guild_id, WINDOW_RATE_RESERVE)
+            if spare_in > 0:
+                await asyncio.sleep(min(max(spare_in, 1.0), WINDOW_POLL))
+                continue
+            async with _window_sem:
+                try:
+                    await resolve_stream(track, margin=STREAM_URL_MARGIN + WINDOW_REFRESH_LEAD, guild_id=self.guild_id)
+                    track.pop("resolve_failed_at", None)
+                except Exception as e:
+                    track["resolve_failed_at"] = time.time()
+                    print(f"[WINDOW] guild={self.guild_id} 미리 해석 실패: {track.get('title')} | {e}")
+            await asyncio.sleep(WINDOW_GAP)
+
 players: Dict[int, GuildMusicPlayer] = {}
 def get_player(guild_id: int) -> GuildMusicPlayer:
     if guild_id not in players:
@@ -359,7 +2537,11 @@ async def ensure_voice(ctx) -> discord.VoiceClient:
         return vc
     return await ctx.author.voice.channel.connect()
 
-def start_playback(vc: discord.VoiceClient, track: dict, guild_player: GuildMusicPlayer, loop: asyncio.AbstractEventLoop):
+# 재생 방식별 사용 횟수 (!stats)
+playback_counts: Dict[str, int] = {"copy": 0, "encode": 0, "pcm": 0}
+
+def build_audio_source(track: dict) -> discord.AudioSource:
+    """PLAYBACK_MODE에 맞는 오디오 소스. 반환 전에 어느 경로(copy/encode/pcm)인지 기록한다."""
     ffmpeg_opts = {
         'before_options': (
             '-reconnect 1 '
@@ -371,16 +2553,32 @@ def start_playback(vc: discord.VoiceClient, track: dict, guild_player: GuildMusi
         'options': '-vn'
     }
 
-    # 원본 오디오 스트림
-    audio_source = discord.FFmpegPCMAudio(track["url"], **ffmpeg_opts)
+    if PLAYBACK_MODE == "pcm":
+        playback_counts["pcm"] += 1
+        # 원본 오디오 스트림 → 파이썬에서 볼륨 조절
+        audio_source = discord.FFmpegPCMAudio(track["url"], **ffmpeg_opts)
+        return discord.PCMVolumeTransformer(audio_source, volume=PLAYBACK_VOLUME)
+
+    if track.get("acodec") == "opus" and PLAYBACK_VOLUME == 1.0:
+        # 유튜브 Opus 패킷을 그대로 디스코드로 (디코딩/인코딩 없음)
+        playback_counts["copy"] += 1
+        return discord.FFmpegOpusAudio(track["url"], codec="copy", **ffmpeg_opts)
+
+    # 볼륨 조절이 필요하거나 원본이 opus가 아니면 ffmpeg 안에서 볼륨 적용 + Opus 인코딩
+    playback_counts["encode"] += 1
+    if PLAYBACK_VOLUME != 1.0:
+        ffmpeg_opts['options'] += f' -filter:a volume={PLAYBACK_VOLUME}'
+    return discord.FFmpegOpusAudio(track["url"], **ffmpeg_opts)
 
-    # ✅ 기본 볼륨 30%로 낮춤 (원하면 0.1~0.5 사이로 조정)
-    audio_source = discord.PCMVolumeTransformer(audio_source, volume=0.3)
+def start_playback(vc: discord.VoiceClient, track: dict, guild_player: GuildMusicPlayer, loop: asyncio.AbstractEventLoop):
+    audio_source = build_audio_source(track)
 
     track["start_time"] = time.time()
     # 모든 재생은 이 함수를 통과하므로 여기서 현재 곡/재생 상태를 일원화한다.
     guild_player.current = track
     guild_player.playing = True
+    guild_player.schedule_prefetch()
+    guild_player.ensure_window_refresher()
 
     def after_play(error):
         if error:
@@ -389,16 +2587,52 @@ def start_playback(vc: discord.VoiceClient, track: dict, guild_player: GuildMusi
 
     vc.play(audio_source, after=after_play)
 
+async def play_resolved(vc: discord.VoiceClient, track: dict, guild_player: GuildMusicPlayer) -> bool:
+    """스트림 URL을 재생 직전에 해석하고 재생을 시작. 해석에 실패했을 때만 False."""
+    try:
+        await resolve_stream(track, guild_id=guild_player.guild_id)
+    except Exception as e:
+        print(f"[RESOLVE] 스트림 해석 실패: {track.get('title')} | {e}")
+        return False
+    if not vc.is_connected():
+        # 해석하는 사이 퇴장한 경우 — 재생할 곳이 없으니 정지 상태로 정리
+        guild_player.playing = False
+        guild_player.current = None
+        return True
+    start_playback(vc, track, guild_player, asyncio.get_running_loop())
+    return True
+
+async def notify_unplayable(channel, track: dict):
+    if channel is None:
+        return
+    try:
+        await channel.send(embed=discord.Embed(color=0xf66c24, description=f"⚠️ **{track.get('title', '?')}** 재생 불가 → 건너뜀"))
+    except Exception as e:
+        print(f"[WARN] 재생 불가 안내 전송 실패: {e}")
+
+async def start_from_queue(vc: discord.VoiceClient, guild_player: GuildMusicPlayer, channel):
+    """정지 상태에서 큐 맨 앞 곡부터 재생 시작. 스트림 해석이 안 되는 곡은 안내 후 건너뜀."""
+    guild_player.playing = True
+    guild_player.text_channel = channel
+    while True:
+        track = guild_player.pop_next_track()
+        if track is None:
+            guild_player.playing = False
+            return
+        if await play_resolved(vc, track, guild_player):
+            if guild_player.current is track:
+                await channel.send(embed=build_now_playing_embed(track, guild_player))
+            return
+        await notify_unplayable(channel, track)
+
 async def handle_after_track(vc: discord.VoiceClient, guild_player: GuildMusicPlayer, track: dict):
-    await asyncio.sleep(0.5)
     duration = track.get("duration", None)
     start_time = track.get("start_time", None)
     play_time = (time.time() - start_time) if start_time else None
 
     if voice_channel_is_empty(vc):
         print("[INFO] 음성 채널에 유저가 없어 즉시 퇴장합니다.")
-        guild_player.playing = False
-        guild_player.current = None
+        guild_player.reset_session()
         if vc.is_connected():
             await vc.disconnect()
         return
@@ -416,11 +2650,14 @@ async def handle_after_track(vc: discord.VoiceClient, guild_player: GuildMusicPl
     else:
         next_track = guild_player.pick_next(track, force_advance=force_advance)
 
-    if next_track is not None:
-        loop = asyncio.get_event_loop()
-        start_playback(vc, next_track, guild_player, loop)
+    while next_track is not None:
+        if not await play_resolved(vc, next_track, guild_player):
+            # 스트림 해석 실패 곡은 반복 대상에서도 빼고 큐의 다음 곡으로
+            await notify_unplayable(guild_player.text_channel, next_track)
+            next_track = guild_player.pop_next_track()
+            continue
         # 곡이 실제로 바뀐 경우에만 안내(한 곡 반복으로 같은 곡 재생 시엔 생략)
-        if guild_player.text_channel is not None and next_track is not track:
+        if guild_player.text_channel is not None and guild_player.current is next_track and next_track is not track:
             try:
                 await guild_player.text_channel.send(embed=build_now_playing_embed(next_track, guild_player))
             except Exception as e:
@@ -434,6 +2671,7 @@ async def handle_after_track(vc: discord.VoiceClient, guild_player: GuildMusicPl
     # 정상 종료했거나, 사용자가 스킵했는데 다음 곡이 없으면 퇴장
     if normal_end or force_advance:
         print("[INFO] 다음 곡 없음 → 퇴장")
+        guild_player.reset_session()
         if vc.is_connected():
             await vc.disconnect()
         if force_advance and guild_player.text_channel is not None:
@@ -452,12 +2690,64 @@ async def maybe_start_playing(ctx, guild_player: GuildMusicPlayer):
     vc = ctx.guild.voice_client
     if vc is None or not vc.is_connected():
         vc = await ensure_voice(ctx)
-    first_track = guild_player.pop_next_track()
-    guild_player.playing = True
-    guild_player.text_channel = ctx.channel
-    loop = asyncio.get_event_loop()
-    start_playback(vc, first_track, guild_player, loop)
-    await ctx.send(embed=build_now_playing_embed(first_track, guild_player))
+    await start_from_queue(vc, guild_player, ctx.channel)
+
+def wait_notifier(status_msg, text: str):
+    """속도 제한 대기 중일 때 상태 메시지에 대기 순번을 보여 주는 on_wait 콜백."""
+    async def _notify(position: int):
+        await status_msg.edit(embed=discord.Embed(
+            color=0x999999, description=f"⏳ 요청이 많아 잠시 대기 중이에요... ({position}번째)\n{text}",
+        ))
+    return _notify
+
+async def enqueue_playlist(ctx, url: str, status_msg):
+    """재생목록을 첫 페이지만 받아 바로 재생을 시작하고, 나머지는 대기열이 줄어들 때마다
+    페이지 단위로 이어서 넣는다. 스트림 URL은 재생/프리페치 시점에 곡별로 해석된다."""
+    player = get_player(ctx.guild.id)
+    session = player.session
+    requester = ctx.author.display_name
+    title = None
+    added = 0
+    pages = iter_playlist(url, guild_id=ctx.guild.id, on_wait=wait_notifier(status_msg, f"📃 `{url}`"))
+    try:
+        async for page in pages:
+            if player.session != session:
+                print(f"[PLAYLIST] guild={ctx.guild.id} 퇴장으로 불러오기 중단")
+                return
+            title = title or page["title"]
+            tracks = [dict(t, requester=requester) for t in page["entries"]]
+            player.extend_queue(tracks)
+            added += len(tracks)
+            await status_msg.edit(embed=discord.Embed(
+                title="📃 재생목록 추가 중",
+                description=f"**{title or url}**\n{added}곡 추가됨 (나머지는 재생하면서 이어서 불러옵니다)",
+                color=0x00ff56,
+            ))
+            if added and not player.playing:
+                await maybe_start_playing(ctx, player)
+            # 다음 페이지는 대기열이 충분히 줄었을 때만 (메모리/추출량이 재생목록 길이가 아니라 창 크기에 비례)
+            while True:
+                vc = ctx.guild.voice_client
+                if player.session != session or vc is None or not vc.is_connected():
+                    print(f"[PLAYLIST] guild={ctx.guild.id} 음성 연결 종료로 불러오기 중단")
+                    return
+                if len(player.queue) < PLAYLIST_LOW_WATER:
+                    break
+                await asyncio.sleep(2.0)
+    except Exception as e:
+        print(f"[PLAYLIST] 불러오기 실패: {url} | {e}")
+        if not added:
+            embed = discord.Embed(color=0xf66c24)
+            embed.add_field(name="⚠️ 재생목록 실패", value="재생목록을 불러오지 못했어요. 공개 재생목록인지 확인해 주세요.")
+            return await status_msg.edit(embed=embed)
+    finally:
+        await pages.aclose()
+    if not added:
+        embed = discord.Embed(color=0xf66c24, description="재생목록에서 재생 가능한 곡을 찾지 못했습니다.")
+        return await status_msg.edit(embed=embed)
+    await status_msg.edit(embed=discord.Embed(
+        title="📃 재생목록 추가 완료", description=f"**{title or url}**\n총 {added}곡", color=0x00ff56,
+    ))
 
 # =========================
 # Commands
@@ -478,11 +2768,8 @@ async def out(ctx):
     if vc and vc.is_connected():
         ch_name = vc.channel.name
         await vc.disconnect()
-        player.queue.clear()
-        player.playing = False
-        player.current = None
+        player.reset_session()
         player.loop_mode = LOOP_OFF
-        player.skip_requested = False
         player.text_channel = None
         embed = discord.Embed(color=0x00ff56)
         embed.add_field(name=":regional_indicator_b::regional_indicator_y::regional_indicator_e:", value=f"{ch_name} 에서 나갔습니다.", inline=False)
@@ -506,33 +2793,39 @@ async def play(ctx, *, query: str = None):
     wait_embed = discord.Embed(color=0x999999, description=f"🔍 `{query}` 검색중...")
     status_msg = await ctx.send(embed=wait_embed)
 
-    # 1차 시도
+    if is_playlist_url(query):
+        try:
+            await ensure_voice(ctx)
+        except commands.CommandError:
+            return
+        return await enqueue_playlist(ctx, query, status_msg)
+
+    # 1차 시도 (곧바로 재생될 곡이면 검색과 스트림 해석을 한 번에)
     try:
-        track_info = await get_track_info(query)
+        track_info = await get_track_info(
+            query, resolve=not get_player(ctx.guild.id).playing,
+            guild_id=ctx.guild.id, on_wait=wait_notifier(status_msg, f"🔍 `{query}`"),
+        )
     except Exception as e:
         print(f"[yt-dlp error-1st] {e}")
         # URL이었다면 → 제목/검색 폴백 시도
         if YOUTUBE_URL_REGEX.match(query):
             title = ""
-            try:
-                meta = await asyncio.to_thread(_ytdlp_from_url_sync, query)  # 메타만 뽑기(실패 무시)
-                title = (meta.get("title") or "").strip()
-            except Exception as e2:
-                print(f"[yt-dlp meta fail] {e2}")
+            # 실패 캐시에 걸린 영상이면 메타 재추출도 실패가 뻔하므로 바로 검색 폴백으로
+            if not isinstance(e, ExtractionBlocked):
+                try:
+                    meta = await extract_url(query, ctx.guild.id)  # 메타만 뽑기(실패 무시)
+                    title = (meta.get("title") or "").strip()
+                except Exception as e2:
+                    print(f"[yt-dlp meta fail] {e2}")
 
             fallback_q = title or query  # 제목이 비어도 원문 query로 검색
             try:
-                candidates = await search_top5(fallback_q)
-                chosen = None
-                for c in candidates:
-                    try:
-                        # 각 후보를 실제 URL 추출로 검증(클라이언트 폴백 내장)
-                        _ = await asyncio.to_thread(_ytdlp_from_url_sync, c["webpage_url"])
-                        chosen = c
-                        break
-                    except Exception as e3:
-                        print(f"[yt-dlp candidate fail] {c.get('title')} | {e3}")
-                        continue
+                candidates = await search_top5(fallback_q, ctx.guild.id)
+                # 각 후보를 실제 URL 추출로 검증(클라이언트 폴백 내장, 동시 검증)
+                found = await first_playable(candidates, guild_id=ctx.guild.id)
+                # 검증하며 얻은 추출 결과(신선한 스트림 URL/만료/포맷)를 그대로 큐에 넣는다
+                chosen = dict(found[1]) if found else None
                 if chosen:
                     chosen["requester"] = ctx.author.display_name
                     player = get_player(ctx.guild.id)
@@ -592,7 +2885,7 @@ async def search_tracks(ctx, *, query: str = None):
     loading_msg = await ctx.send(embed=wait_embed)
 
     try:
-        results = await search_top5(query)
+        results = await search_top5(query, ctx.guild.id, on_wait=wait_notifier(loading_msg, f"🔍 `{query}`"))
     except Exception as e:
         print(f"[yt-dlp error-search] {e}")
         nores_embed = discord.Embed(color=0xf66c24)
@@ -638,9 +2931,10 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
     member = guild.get_member(payload.user_id)
     requester_name = member.display_name if member else "unknown"
 
-    # 후보 URL 실재성 검증(클라 폴백 포함) 후 큐 추가
+    # 후보 URL 실재성 검증(클라 폴백 포함) 후 큐 추가.
+    # 검증 추출 결과(신선한 스트림 URL/만료/포맷)를 그대로 트랙으로 쓴다(공유 캐시에도 저장됨).
     try:
-        _ = await asyncio.to_thread(_ytdlp_from_url_sync, chosen["webpage_url"])
+        resolved = await extract_url(chosen["webpage_url"], guild.id)
     except Exception as e:
         print(f"[yt-dlp candidate failed @reaction] {chosen.get('title')} | {e}")
         channel = guild.get_channel(payload.channel_id)
@@ -648,14 +2942,8 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
             await channel.send(embed=discord.Embed(color=0xf66c24, description="선택한 영상은 차단되어 재생할 수 없어요. 다른 항목을 선택해 주세요."))
         return
 
-    track_info = {
-        "webpage_url": chosen["webpage_url"],
-        "url": chosen["url"],
-        "title": chosen["title"],
-        "duration": chosen["duration"],
-        "thumbnail": chosen.get("thumbnail"),
-        "requester": requester_name,
-    }
+    track_info = dict(resolved)
+    track_info["requester"] = requester_name
     player.add_to_queue(track_info)
 
     channel = guild.get_channel(payload.channel_id)
@@ -669,12 +2957,7 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
                 if member and member.voice and member.voice.channel:
                     vc = await member.voice.channel.connect()
             if vc and vc.is_connected():
-                first_track = player.pop_next_track()
-                player.playing = True
-                player.text_channel = channel
-                loop = asyncio.get_event_loop()
-                start_playback(vc, first_track, player, loop)
-                await channel.send(embed=build_now_playing_embed(first_track, player))
+                await start_from_queue(vc, player, channel)
 
 @bot.command(name="skip")
 async def skip_track(ctx):
@@ -733,6 +3016,7 @@ async def shuffle_list(ctx):
         embed.add_field(name=":grey_question:", value="섞을 대기열이 없습니다.")
         return await ctx.send(embed=embed)
     random.shuffle(player.queue)
+    player.queue_changed()
     embed = discord.Embed(color=0x00ff56)
     embed.add_field(name="🔀 셔플 완료", value="대기열의 순서를 무작위로 변경했습니다.")
     await ctx.send(embed=embed)
@@ -768,9 +3052,11 @@ async def loop_cmd(ctx, mode: str = None):
     # 같은 모드를 다시 누르면 토글로 해제
     if new_mode != LOOP_OFF and new_mode == player.loop_mode:
         player.loop_mode = LOOP_OFF
+        player.queue_changed()
         return await ctx.send(embed=discord.Embed(color=0x00ff56, description=f"{LOOP_LABELS[new_mode]} 을(를) 해제했습니다."))
 
     player.loop_mode = new_mode
+    player.queue_changed()
     await ctx.send(embed=discord.Embed(color=0x00ff56, description=f"반복 모드: **{LOOP_LABELS[new_mode]}**"))
 
 @bot.command(name="np", aliases=["nowplaying", "now", "현재곡", "재생중"])
@@ -784,19 +3070,186 @@ async def now_playing(ctx):
         return await ctx.send(embed=embed)
     await ctx.send(embed=build_now_playing_embed(player.current, player))
 
+@bot.command(name="stats", aliases=["통계"])
+async def show_stats(ctx):
+    """추출 파이프라인 상태(클라이언트 점수 등) 표시."""
+    embed = discord.Embed(title="📊 추출 통계", color=0x999999)
+    lines = [f"`{name}` 성공률 {st['score']} · 지연 {st['latency'] if st['latency'] is not None else '-'}s "
+             f"(성공 {st['ok']} / 실패 {st['fail']})"
+             for name, st in client_scores.snapshot().items()]
+    embed.add_field(name="player_client", value="\n".join(lines), inline=False)
+    extractor_stats = extractor.stats()
+    if EXTRACT_BACKEND != "process":
+        counts = hedge_counts_snapshot()
+        extractor_stats += f"\n재시도/헤지 추가 추출 {counts['extra']}"
+        if YTDLP_HEDGE:
+            extractor_stats += f", 헤지 시작 {counts['launched']} / 상한으로 건너뜀 {counts['skipped']}"
+    embed.add_field(name=f"추출 실행기 ({EXTRACT_BACKEND})", value=extractor_stats, inline=False)
+    embed.add_field(name="속도 제한", value=rate_limiter.stats(), inline=False)
+    if pot_supervisor is not None:
+        embed.add_field(name="POT 공급자", value=pot_supervisor.stats(), inline=False)
+    if po_token_cache is not None:
+        embed.add_field(name="PO 토큰 캐시", value=po_token_cache.stats(), inline=False)
+    embed.add_field(
+        name=f"재생 방식 ({PLAYBACK_MODE}, 볼륨 {PLAYBACK_VOLUME})",
+        value=", ".join(f"{k} {v}" for k, v in playback_counts.items()), inline=False,
+    )
+    if warmup_timings:
+        value = ", ".join(f"{k} {v}" for k, v in warmup_timings.items())
+        if warmup_failures:
+            value = f"⚠️ 실패: {', '.join(warmup_failures)}\n{value}"
+        embed.add_field(name="시작 예열", value=value, inline=False)
+    embed.add_field(name="YoutubeDL 풀", value=f"생성 {ydl_pool.created} / 재사용 {ydl_pool.reused}", inline=False)
+    embed.add_field(name="메타 캐시", value=meta_cache.stats(), inline=False)
+    embed.add_field(name="스트림 캐시", value=stream_cache.stats(), inline=False)
+    if persistent_cache is not None:
+        embed.add_field(name="영구 캐시(SQLite)", value=persistent_cache.stats(), inline=False)
+    embed.add_field(name="동시 요청 합치기", value=f"검색: {track_flights.stats()}\nURL: {url_flights.stats()}", inline=False)
+    embed.add_field(name="실패 캐시", value=f"{len(negative_cache)}개 보관 / 적중 {negative_cache.hits}", inline=False)
+    await ctx.send(embed=embed)
+
+# =========================
+# 시작 시 추출 경로 예열
+# =========================
+# 배포 직후 첫 !p가 extractor import, player JS 다운로드, n-challenge(JS 런타임) 첫 실행,
+# POT 서버 첫 왕복을 모두 떠안지 않도록 on_ready에서 미리 한 번씩 거쳐 둔다.
+# 기본 예열은 네트워크 없이 yt_dlp import와 YoutubeDL 인스턴스(player_client별, flat 검색/재생목록용)만 만든다.
+YTDLP_WARMUP = os.getenv("YTDLP_WARMUP", "1") == "1"
+# 지정하면(기본은 빈 값) 이 URL을 전체 추출해 실제 유튜브 경로(player JS/n-challenge/POT)까지 확인한다.
+# 데이터센터 IP에서 재시작마다 유튜브에 요청하고 속도 제한 토큰도 쓰므로 필요할 때만 켠다.
+YTDLP_WARMUP_PROBE = os.getenv("YTDLP_WARMUP_PROBE", "")
+# flat 검색 경로 예열용 검색어. 빈 값(기본)이면 생략.
+YTDLP_WARMUP_SEARCH = os.getenv("YTDLP_WARMUP_SEARCH", "")
+
+warmup_timings: Dict[str, str] = {}
+warmup_failures: List[str] = []
+_warmup_task: Optional[asyncio.Task] = None
+
+async def _warmup_stage(name: str, coro_factory) -> bool:
+    t0 = time.monotonic()
+    try:
+        await coro_factory()
+        result = f"{time.monotonic() - t0:.2f}s"
+        print(f"[HEALTH] warmup {name}: ok {result}")
+        ok = True
+    except Exception as e:
+        result = f"실패 {time.monotonic() - t0:.2f}s"
+        print(f"[HEALTH] warmup {name}: fail {time.monotonic() - t0:.2f}s | {e}")
+        warmup_failures.append(name)
+        ok = False
+    warmup_timings[name] = result
+    return ok
+
+async def warm_up_extraction() -> bool:
+    """추출 경로 예열. 단계별 소요 시간을 [HEALTH] 로그와 !stats에 남기고, 모든 단계가 성공했는지 돌려준다.
+    실패한 단계는 warmup_failures에 남아 !stats에 경고로 보인다(봇은 계속 동작)."""
+    t0 = time.monotonic()
+    await _warmup_stage("import", lambda: asyncio.to_thread(get_yt_dlp))
+    # 실행기 자리 수만큼 동시에 돌려 (process 백엔드면) 워커 프로세스를 모두 띄우고 YoutubeDL 인스턴스를 만든다
+    await _warmup_stage("ydl", lambda: asyncio.gather(
+        *(extractor.run(_warm_process_worker) for _ in range(extractor.max_workers))
+    ))
+    if YTDLP_WARMUP_PROBE:
+        if pot_supervisor is not None:
+            await _warmup_stage("pot", lambda: asyncio.to_thread(pot_supervisor.ping))
+        # 스레드 백엔드는 이 프로세스의 토큰 캐시를 쓰므로 첫 토큰을 미리 받아 둔다
+        if po_token_cache is not None and EXTRACT_BACKEND != "process" and get_shared_cookies() is None:
+            await _warmup_stage("po_token", lambda: asyncio.to_thread(po_token_cache.get))
+    if YTDLP_WARMUP_SEARCH:
+        await _warmup_stage("search", lambda: limited_run(None, _ytdlp_search_flat_sync, YTDLP_WARMUP_SEARCH, 1))
+    if YTDLP_WARMUP_PROBE:
+        # 캐시/실패 캐시에 남기지 않도록 extract_url이 아니라 동기 추출을 바로 돌린다
+        await _warmup_stage("probe", lambda: limited_run(None, _ytdlp_from_url_sync, YTDLP_WARMUP_PROBE))
+    warmup_timings["total"] = f"{time.monotonic() - t0:.2f}s"
+    if warmup_failures:
+        print(f"[HEALTH] warmup FAILED ({', '.join(warmup_failures)}) in {warmup_timings['total']} "
+              f"→ 첫 요청이 같은 이유로 실패할 수 있음")
+        return False
+    print(f"[HEALTH] warmup done in {warmup_timings['total']}")
+    return True
+
+# =========================
+# 설정 다시 읽기 (쿠키 파일 변경 감시 / SIGHUP)
+# =========================
+COOKIES_WATCH_INTERVAL = float(os.getenv("COOKIES_WATCH_INTERVAL", "30"))
+_config_reload_installed = False
+_config_watch_task: Optional[asyncio.Task] = None
+
+async def watch_cookie_file():
+    """쿠키 파일 mtime이 바뀌면(교체/갱신/새로 생김/삭제) 설정을 다시 읽는다."""
+    while True:
+        await asyncio.sleep(COOKIES_WATCH_INTERVAL)
+        if extraction_config.cookie_file_changed():
+            reload_extraction_config("cookie file changed")
+
+def install_config_reload():
+    """쿠키 감시 작업을 시작하고 SIGHUP에 설정 다시 읽기를 건다(한 번만)."""
+    global _config_reload_installed, _config_watch_task
+    if _config_reload_installed:
+        return
+    _config_reload_installed = True
+    if extraction_config.cookie_path:
+        _config_watch_task = asyncio.ensure_future(watch_cookie_file())
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_extraction_config, "SIGHUP")
+    except (AttributeError, NotImplementedError, RuntimeError) as e:
+        # Windows 등 SIGHUP/시그널 핸들러가 없는 환경
+        print(f"[CONFIG] SIGHUP reload unavailable: {e}")
+
+# 봇의 음성 상태가 "채널 없음"이 된 뒤 세션을 정리하기까지 기다리는 시간(초, 재연결이면 그 안에 돌아온다)
+VOICE_DISCONNECT_GRACE = 3.0
+
+@bot.event
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    # 봇이 음성 채널에서 실제로 빠진 경우(강제 퇴장/연결 끊김)에만 플레이어 상태 정리.
+    # 채널 이동(after.channel이 다른 채널)이나 음성 서버/지역 변경에 따른 재연결은 세션을 유지한다.
+    if member.id != bot.user.id or before.channel is None or after.channel is not None:
+        return
+    # 재연결 중에는 잠깐 채널 없음 상태가 올 수 있으므로 유예 뒤에도 빠져 있을 때만 정리
+    await asyncio.sleep(VOICE_DISCONNECT_GRACE)
+    guild = member.guild
+    if guild.voice_client is not None or (guild.me.voice and guild.me.voice.channel):
+        return
+    player = players.get(guild.id)
+    if player is not None:
+        print(f"[INFO] guild={guild.id} 음성 연결 종료 → 큐/세션 정리")
+        player.reset_session()
+
 # =========================
 # on_ready
 # =========================
+@bot.event
+async def setup_hook():
+    boot_mark("login")
+
+@bot.event
+async def on_connect():
+    boot_mark("gateway")
+
 @bot.event
 async def on_ready():
     print(f'{bot.user} 봇을 실행합니다.')
+    if all(name != "ready" for name, _ in BOOT_TIMELINE):
+        boot_mark("ready")
+        print(f"[BOOT] {boot_timeline_text()}")
     print(f"[HEALTH] ffmpeg in PATH? {shutil.which('ffmpeg')}")
-    cookiefile = os.getenv("YTDLP_COOKIES")
-    print(f"[HEALTH] YTDLP_COOKIES={cookiefile} exists={os.path.exists(cookiefile) if cookiefile else None}")
-    print(f"[HEALTH] BGUTIL_POT_BASE_URL={os.getenv('BGUTIL_POT_BASE_URL')}")
+    config = extraction_config
+    print(f"[HEALTH] YTDLP_COOKIES={config.cookie_path} exists={config.cookie_mtime is not None}")
+    print(f"[HEALTH] BGUTIL_POT_BASE_URL={config.pot_base_url}")
+    install_config_reload()
+    if pot_supervisor is not None:
+        pot_supervisor.start()
     print(f"[HEALTH] Opus loaded? {discord.opus.is_loaded()}")
+    global _warmup_task
+    # on_ready는 재연결 때마다 다시 불리므로 예열은 한 번만
+    if YTDLP_WARMUP and _warmup_task is None:
+        print(f"[HEALTH] warmup start (backend={EXTRACT_BACKEND}, probe={YTDLP_WARMUP_PROBE or '-'})")
+        _warmup_task = asyncio.ensure_future(warm_up_extraction())
 
 # =========================
 # run
 # =========================
-bot.run(Token)
\ No newline at end of file
+# EXTRACT_BACKEND=process의 워커는 이 파일을 다시 import하므로 봇 실행은 메인 프로세스에서만.
+if __name__ == "__main__":
+    boot_mark("module")
+    bot.run(Token)
\ No newline at end of file